@@ -0,0 +1,336 @@
+'''
+benchmarks for the interpreter, run with
+    python benchmarks.py <benchmark> [size ...]
+where each size is the number of statements in the generated program
+'''
+import contextlib
+import gc
+import io
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import main as cli
+from pascal_interpreter.execution import execute, PreparedProgram
+from pascal_interpreter.interpreter import Interpreter
+from pascal_interpreter.lexer import Lexer, TokenStream
+from pascal_interpreter.node_factory import NodeFactory, InterningNodeFactory
+from pascal_interpreter.node_types import ASTNode
+from pascal_interpreter.parallel_lexer import tokenize, parallel_tokenize
+from pascal_interpreter.parser import Parser
+from pascal_interpreter.symbol_table import SymbolTableBuilderVisitor
+from pascal_interpreter.tracing import TraceBuffer
+from pascal_interpreter.visitor import Visitor
+
+DEFAULT_SIZES = [1000, 10000]
+
+# `tracing` fails if tracing slows execution down by more than this; the
+# benchmark records the two assignments of each loop iteration (FOR
+# counters are not traced by default) and measures 25-45%
+TRACE_OVERHEAD_BUDGET = 0.5
+
+# `memory` fails if any of these are exceeded: peak bytes per generated
+# statement for each phase, and shallow bytes per object of each class
+MEMORY_BUDGETS = {
+    'phase_peak_per_statement': {
+        'lex': 2500,
+        'parse': 2000,
+        'symtab': 500,
+        'run': 500,
+    },
+    'object': {
+        'Token': 200,
+        'default': 400,
+    },
+}
+
+def generate_program(statements, variables=10):
+    '''
+    return the source of a straight-line program with `statements`
+    assignments over `variables` INTEGER variables
+    '''
+    names = ['v{}'.format(i) for i in range(variables)]
+    lines = [
+        'PROGRAM Generated;',
+        'VAR',
+        '    {}: INTEGER;'.format(', '.join(names)),
+        'BEGIN',
+    ]
+    for name in names:
+        lines.append('    {} := 1;'.format(name))
+    for i in range(statements):
+        target = names[i % variables]
+        left = names[(i + 1) % variables]
+        right = names[(i + 3) % variables]
+        lines.append('    {} := ({} + {} * 2) DIV 3 - {} + 1;'.format(
+            target, left, right, target))
+    lines.append('END.')
+    return '\n'.join(lines)
+
+def _retained_bytes(func):
+    '''return (result of `func()`, bytes still allocated by it)'''
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+def interning(sizes):
+    '''tree memory with and without `InterningNodeFactory`'''
+    print('{:>10} {:>14} {:>14} {:>8}'.format(
+        'statements', 'plain bytes', 'interned bytes', 'ratio'))
+    for size in sizes:
+        text = generate_program(size)
+        _, plain = _retained_bytes(
+            lambda: Parser(Lexer(text), NodeFactory()).parse())
+        _, interned = _retained_bytes(
+            lambda: Parser(Lexer(text), InterningNodeFactory()).parse())
+        print('{:>10} {:>14} {:>14} {:>8.2f}'.format(
+            size, plain, interned, plain / interned))
+
+def _scalar_program(size):
+    names = ['v{}'.format(i) for i in range(size)]
+    lines = ['PROGRAM Scalars;', 'VAR s : INTEGER;']
+    lines.extend('    {}: INTEGER;'.format(name) for name in names)
+    lines.append('BEGIN')
+    lines.extend('    {} := {};'.format(name, i) for i, name in enumerate(names))
+    lines.append('    s := 0;')
+    lines.extend('    s := s + {};'.format(name) for name in names)
+    lines.append('END.')
+    return '\n'.join(lines)
+
+def _array_program(size):
+    return '''
+        PROGRAM Arrays;
+        VAR s, i : INTEGER;
+            v : ARRAY [0..{hi}] OF INTEGER;
+        BEGIN
+            FOR i := 0 TO {hi} DO v[i] := i;
+            s := 0;
+            FOR i := 0 TO {hi} DO s := s + v[i]
+        END.
+    '''.format(hi=size - 1)
+
+def arrays(sizes):
+    '''ARRAY storage against one scalar VAR per element'''
+    print('{:>10} {:>8} {:>10} {:>14}'.format(
+        'elements', 'program', 'seconds', 'scope bytes'))
+    for size in sizes:
+        for name, generate in (('scalars', _scalar_program),
+                ('array', _array_program)):
+            text = generate(size)
+            environment, elapsed = _timed(lambda: execute(text))
+            assert environment.scope['S'] == size * (size - 1) // 2
+            _, scope_bytes = _retained_bytes(
+                lambda: execute(text).scope)
+            print('{:>10} {:>8} {:>10.3f} {:>14}'.format(
+                size, name, elapsed, scope_bytes))
+
+def tracing(sizes):
+    '''
+    execution time with and without a `TraceBuffer`; fails if the
+    overhead exceeds `TRACE_OVERHEAD_BUDGET`
+    '''
+    failures = []
+    print('{:>10} {:>10} {:>10} {:>9}'.format(
+        'iterations', 'untraced', 'traced', 'overhead'))
+    for size in sizes:
+        text = '''
+            PROGRAM Traced;
+            VAR i, s, t : INTEGER;
+            BEGIN
+                s := 0;
+                FOR i := 1 TO {n} DO BEGIN s := s + i; t := s * 2 - i END
+            END.
+        '''.format(n=size)
+        interpreter = Interpreter(Parser(Lexer(text)).parse())
+        interpreter.interpret(SymbolTableBuilderVisitor())
+        # alternate the runs so that both see the same machine load
+        untraced = traced = float('inf')
+        for _ in range(9):
+            untraced = min(untraced,
+                _timed(lambda: interpreter.interpret(Visitor()))[1])
+            traced = min(traced, _timed(lambda: interpreter.interpret(
+                Visitor(), trace=TraceBuffer()))[1])
+        overhead = traced / untraced - 1
+        print('{:>10} {:>10.3f} {:>10.3f} {:>8.1%}'.format(
+            size, untraced, traced, overhead))
+        if overhead > TRACE_OVERHEAD_BUDGET:
+            failures.append('{} iterations: {:.1%} > {:.0%}'.format(
+                size, overhead, TRACE_OVERHEAD_BUDGET))
+
+    for failure in failures:
+        print('OVERHEAD EXCEEDED: ' + failure)
+    return not failures
+
+def prepared(sizes, runs=10):
+    '''
+    per-run cost of `PreparedProgram.run` against calling `main.interpret`
+    on the source each time; the input is the initial value of `v0`
+    '''
+    print('{:>10} {:>12} {:>12} {:>9}'.format(
+        'statements', 'interpret', 'prepared', 'speed-up'))
+    for size in sizes:
+        text = generate_program(size)
+        program = PreparedProgram(text.replace('v0 := 1;', '', 1), ['v0'])
+        assert program.run({'v0': 1}) == execute(text).scope
+
+        def interpret_each_time():
+            with contextlib.redirect_stdout(io.StringIO()):
+                for value in range(runs):
+                    cli.interpret(text.replace(
+                        'v0 := 1;', 'v0 := {};'.format(value), 1))
+
+        def run_prepared():
+            for value in range(runs):
+                program.run({'v0': value})
+
+        interpreted = _timed(interpret_each_time)[1] / runs
+        prepared_run = _timed(run_prepared)[1] / runs
+        print('{:>10} {:>12.5f} {:>12.5f} {:>9.2f}'.format(
+            size, interpreted, prepared_run, interpreted / prepared_run))
+
+def _timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def lexing(sizes):
+    '''parallel lexing speed-up by worker count'''
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted({1, cpus} | {2 ** i for i in range(8) if 2 ** i < cpus})
+    print('{:>10} {:>8} {:>10} {:>8}'.format(
+        'statements', 'workers', 'seconds', 'speed-up'))
+    for size in sizes:
+        text = generate_program(size)
+        expected, sequential = _timed(lambda: tokenize(text))
+        print('{:>10} {:>8} {:>10.3f} {:>8.2f}'.format(
+            size, 'seq', sequential, 1.0))
+        for workers in worker_counts:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # start the worker processes before timing
+                list(pool.map(abs, range(workers)))
+                tokens, elapsed = _timed(lambda: parallel_tokenize(
+                    text, workers, min_chunk_size=4096, executor=pool))
+            assert tokens == expected
+            print('{:>10} {:>8} {:>10.3f} {:>8.2f}'.format(
+                size, workers, elapsed, sequential / elapsed))
+
+def _measure(func):
+    '''
+    return (result of `func()`, peak bytes allocated while it ran, bytes
+    it left allocated); tracemalloc must be running
+    '''
+    gc.collect()
+    base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    result = func()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    return result, peak - base, current - base
+
+def _shallow_size(obj):
+    return sys.getsizeof(obj) + sys.getsizeof(obj.__dict__)
+
+def _walk(node):
+    '''yield every distinct AST node in the tree below `node`'''
+    seen = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        yield node
+        for value in vars(node).values():
+            if isinstance(value, ASTNode):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(v for v in value if isinstance(v, ASTNode))
+
+def _object_sizes(tokens, tree):
+    '''return {class name: (count, average shallow bytes)}'''
+    totals = {}
+    objects = [('Token', token) for token in tokens]
+    objects.extend((type(node).__name__, node) for node in _walk(tree))
+    for name, obj in objects:
+        count, size = totals.get(name, (0, 0))
+        totals[name] = (count + 1, size + _shallow_size(obj))
+    return {name: (count, size / count)
+        for name, (count, size) in totals.items()}
+
+def memory(sizes):
+    '''
+    peak and retained bytes of each phase and bytes per object, checked
+    against `MEMORY_BUDGETS`
+    '''
+    failures = []
+    phase_budgets = MEMORY_BUDGETS['phase_peak_per_statement']
+    object_budgets = MEMORY_BUDGETS['object']
+    print('{:>10} {:>8} {:>14} {:>14} {:>12}'.format(
+        'statements', 'phase', 'peak bytes', 'retained', 'peak/stmt'))
+    for size in sizes:
+        text = generate_program(size)
+        visitor = Visitor()
+
+        tracemalloc.start()
+        phases = []
+        tokens, peak, retained = _measure(lambda: tokenize(text))
+        phases.append(('lex', peak, retained))
+        tree, peak, retained = _measure(
+            lambda: Parser(TokenStream(tokens)).parse())
+        phases.append(('parse', peak, retained))
+        interpreter = Interpreter(tree)
+        _, peak, retained = _measure(
+            lambda: interpreter.interpret(SymbolTableBuilderVisitor()))
+        phases.append(('symtab', peak, retained))
+        _, peak, retained = _measure(lambda: interpreter.interpret(visitor))
+        phases.append(('run', peak, retained))
+        tracemalloc.stop()
+
+        for phase, peak, retained in phases:
+            per_statement = peak / size
+            print('{:>10} {:>8} {:>14} {:>14} {:>12.1f}'.format(
+                size, phase, peak, retained, per_statement))
+            if per_statement > phase_budgets[phase]:
+                failures.append('{} statements: {} peak {:.1f} B/stmt > {}'
+                    .format(size, phase, per_statement, phase_budgets[phase]))
+
+        for name, (count, average) in sorted(
+                _object_sizes(tokens, tree).items()):
+            budget = object_budgets.get(name, object_budgets['default'])
+            print('{:>10} {:>19} x{:<8} {:>8.1f} B each'.format(
+                size, name, count, average))
+            if average > budget:
+                failures.append('{} statements: {} {:.1f} B > {}'.format(
+                    size, name, average, budget))
+
+    for failure in failures:
+        print('BUDGET EXCEEDED: ' + failure)
+    return not failures
+
+BENCHMARKS = {
+    'arrays': arrays,
+    'interning': interning,
+    'lexing': lexing,
+    'memory': memory,
+    'prepared': prepared,
+    'tracing': tracing,
+}
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print('usage: python benchmarks.py {%s} [size ...]'
+            % '|'.join(sorted(BENCHMARKS)))
+        sys.exit(1)
+    sizes = [int(arg) for arg in sys.argv[2:]] or DEFAULT_SIZES
+    if BENCHMARKS[sys.argv[1]](sizes) is False:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
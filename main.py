@@ -3,10 +3,12 @@ import sys
 from pascal_interpreter.interpreter import Interpreter
 from pascal_interpreter.parser import Parser
 from pascal_interpreter.lexer import Lexer
+from pascal_interpreter.optimizer import Optimizer
+from pascal_interpreter.session import Session
 from pascal_interpreter.symbol_table import SymbolTableBuilderVisitor
 from pascal_interpreter.visitor import Visitor
 
-def interpret(text):
+def interpret(text, optimize=False):
     lexer = Lexer(text)
     parser = Parser(lexer)
     tree = parser.parse()
@@ -14,18 +16,25 @@ def interpret(text):
     symtable_builder = SymbolTableBuilderVisitor()
     visitor = Visitor()
     interpreter.interpret(symtable_builder)
+    if optimize:
+        print(interpreter.interpret(Optimizer()))
     result = interpreter.interpret(visitor)
     print(symtable_builder.symtable)
-    for k, v in sorted(visitor.GLOBAL_SCOPE.items()):
+    for k, v in sorted(visitor.scope.items()):
         print('%s: %s' % (k, v))
 
 # TODO add debug argument to print full stacktrace
 def main():
-    if len(sys.argv) > 1:
-        with open(sys.argv[1], 'r') as f:
+    args = sys.argv[1:]
+    optimize = '-O' in args
+    if optimize:
+        args.remove('-O')
+    if args:
+        with open(args[0], 'r') as f:
             text = f.read()
-        interpret(text)
+        interpret(text, optimize)
     else:
+        session = Session(optimize)
         while True:
             try:
                 text = input('pascal>')
@@ -36,10 +45,13 @@ def main():
                 continue
 
             try:
-                interpret(text)
+                names = session.execute(text)
             except Exception as e:
                 print(e)
                 continue
 
+            for name in names:
+                print('%s: %s' % (name, session.scope.get(name)))
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+
+class Frame(dict):
+    '''
+    the variables of one function activation: the names declared by the
+    function live here, every other name is read from and written to
+    `parent`, the frame of the enclosing scope
+    '''
+    def __init__(self, parent, names):
+        super(Frame, self).__init__(dict.fromkeys(names))
+        self.parent = parent
+
+    def get(self, name, default=None):
+        if name in self:
+            return dict.__getitem__(self, name)
+        return self.parent.get(name, default)
+
+    def __missing__(self, name):
+        return self.parent[name]
+
+    def __setitem__(self, name, value):
+        if name in self:
+            dict.__setitem__(self, name, value)
+        else:
+            self.parent[name] = value
+
+class FunctionCache(object):
+    '''
+    bounded least-recently-used cache of pure function results, with
+    hit/miss statistics. A capacity of 0 disables caching.
+    '''
+    MISSING = object()
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def lookup(self, key):
+        '''return the cached result for `key` or `FunctionCache.MISSING`'''
+        result = self._results.get(key, self.MISSING)
+        if result is self.MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._results.move_to_end(key)
+        return result
+
+    def store(self, key, result):
+        if self.capacity <= 0:
+            return
+        self._results[key] = result
+        if len(self._results) > self.capacity:
+            self._results.popitem(last=False)
+
+    def __str__(self):
+        return 'FunctionCache({} hits, {} misses, {:.1%} hit rate)'.format(
+            self.hits, self.misses, self.hit_rate)
+
+    def __repr__(self):
+        return self.__str__()
+
+class Environment(object):
+    '''
+    the mutable state of one execution of a program: the variable scope,
+    the optimizer temporaries and the cache of pure function results.
+    Each execution gets its own `Environment`, so visitors never share
+    state.
+    '''
+    def __init__(self, scope=None, cache_capacity=1024):
+        self.scope = scope if scope is not None else {}
+        self.temps = {}
+        self.function_cache = FunctionCache(cache_capacity)
+
+    def __str__(self):
+        return 'Environment({})'.format(self.scope)
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from .environment import Environment
+from .interpreter import Interpreter
+from .keywords import REAL
+from .lexer import Lexer
+from .parser import Parser
+from .symbol_table import (SymbolTableBuilderVisitor, VarSymbol,
+    ArrayTypeSymbol)
+from .visitor import Visitor
+
+def _analyse(text, symtable_builder=None):
+    tree = Parser(Lexer(text)).parse()
+    interpreter = Interpreter(tree)
+    if symtable_builder is None:
+        symtable_builder = SymbolTableBuilderVisitor()
+    interpreter.interpret(symtable_builder)
+    return interpreter
+
+def execute(text, environment=None):
+    '''
+    lex, parse, analyse and run one program and return the `Environment`
+    it ran in. Nothing is shared with other executions, so `execute` may
+    be called from several threads at once.
+    '''
+    interpreter = _analyse(text)
+    if environment is None:
+        environment = Environment()
+    interpreter.interpret(Visitor(), environment)
+    return environment
+
+def execute_concurrently(texts, max_workers=None):
+    '''
+    run every program in `texts` on a thread pool and return their
+    environments in the same order; the first exception raised by a
+    program is re-raised
+    '''
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(execute, texts))
+
+async def execute_async(text, environment=None, yield_every=100,
+        timeout=None):
+    '''
+    `execute` for asyncio code: analysis runs synchronously (its cost
+    depends only on the size of the source) and execution is handed to
+    `Interpreter.interpret_async`
+    '''
+    interpreter = _analyse(text)
+    return await interpreter.interpret_async(environment, yield_every,
+        timeout)
+
+class PreparedProgram(object):
+    '''
+    a program that is lexed, parsed and analysed once and then run any
+    number of times, like a prepared SQL statement. `parameters` names
+    declared scalar variables of the program whose initial values are
+    bound by each call to `run`; REAL inputs are converted to float.
+    Runs share only the analysed tree, so `run` may be called from several
+    threads at once.
+    '''
+    def __init__(self, text, parameters=()):
+        symtable_builder = SymbolTableBuilderVisitor()
+        self.interpreter = _analyse(text, symtable_builder)
+        self.symtable = symtable_builder.symtable
+        # upper-cased name -> whether the input is converted to float
+        self.parameters = {}
+        for name in parameters:
+            symbol = self.symtable.lookup(name.upper(), current_scope_only=True)
+            if not isinstance(symbol, VarSymbol):
+                raise NameError(str(name))
+            if isinstance(symbol.type, ArrayTypeSymbol):
+                raise TypeError(
+                    '{} is an array and cannot be an input'.format(name))
+            self.parameters[symbol.name] = symbol.type.name == REAL
+
+    def run(self, inputs=None):
+        '''
+        run the program with `inputs` ({parameter name: value}, one value
+        for every parameter) as the initial values of its parameters and
+        return the resulting scope
+        '''
+        scope = {}
+        for name, value in (inputs or {}).items():
+            key = name.upper()
+            to_float = self.parameters.get(key)
+            if to_float is None:
+                raise TypeError(
+                    '{} is not a parameter of the program'.format(name))
+            if key in scope:
+                raise TypeError('{} is bound more than once'.format(key))
+            scope[key] = float(value) if to_float else value
+        if len(scope) != len(self.parameters):
+            raise TypeError('missing input(s): {}'.format(', '.join(
+                name for name in self.parameters if name not in scope)))
+        self.interpreter.interpret(Visitor(), Environment(scope))
+        return scope
@@ -1,12 +1,53 @@
+import asyncio
+
+from .visitor import SteppingVisitor
+
 class Interpreter(object):
     '''
     Interpreter is configured with one parse tree (output of parser)
     `interpret` method may be called several times with different
-    visitors in order to allow multiple passes through the parse tree
+    visitors in order to allow multiple passes through the parse tree.
+    The tree is never modified by execution, so one `Interpreter` may run
+    in several threads at once as long as each call has its own visitor
+    and `environment`
     '''
     def __init__(self, tree):
         self.tree = tree
 
-    def interpret(self, visitor):
+    def interpret(self, visitor, environment=None, trace=None):
+        '''
+        pass `trace` (a `TraceBuffer`) to record every assignment the
+        visitor executes; without it nothing is recorded, even by a
+        visitor that was traced before
+        '''
         # print(self.tree)
+        if environment is not None:
+            visitor.bind(environment)
+        visitor.trace = trace
         return self.tree.accept(visitor)
+
+    async def interpret_async(self, environment=None, yield_every=100,
+            timeout=None):
+        '''
+        execute the tree without blocking the event loop: control is
+        handed back to the loop after every `yield_every` statements or
+        loop iterations, which is also where cancellation takes effect.
+        If `timeout` seconds pass before the program finishes,
+        `asyncio.TimeoutError` is raised. Returns the environment.
+        '''
+        if yield_every < 1:
+            raise ValueError('yield_every must be at least 1, got {}'.format(
+                yield_every))
+        visitor = SteppingVisitor(environment)
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        steps = 0
+        for _ in self.tree.accept(visitor):
+            steps += 1
+            if steps == yield_every:
+                steps = 0
+                if deadline is not None and loop.time() >= deadline:
+                    raise asyncio.TimeoutError(
+                        'program exceeded {}s deadline'.format(timeout))
+                await asyncio.sleep(0)
+        return visitor.environment
@@ -22,7 +22,24 @@
     DOT,
     COLON,
     COMMA,
-    PROCEDURE
+    PROCEDURE,
+    WHILE,
+    DO,
+    FOR,
+    TO,
+    DOWNTO,
+    EQUAL,
+    NOT_EQUAL,
+    LESS_THAN,
+    LESS_EQUAL,
+    GREATER_THAN,
+    GREATER_EQUAL,
+    ARRAY,
+    OF,
+    LBRACKET,
+    RBRACKET,
+    RANGE,
+    FUNCTION
 ) = (
     'INTEGER_CONST',
     'FLOAT_CONST',
@@ -46,7 +63,24 @@
     'DOT',
     'COLON',
     'COMMA',
-    'PROCEDURE'
+    'PROCEDURE',
+    'WHILE',
+    'DO',
+    'FOR',
+    'TO',
+    'DOWNTO',
+    'EQUAL',
+    'NOT_EQUAL',
+    'LESS_THAN',
+    'LESS_EQUAL',
+    'GREATER_THAN',
+    'GREATER_EQUAL',
+    'ARRAY',
+    'OF',
+    '[',
+    ']',
+    'RANGE',
+    'FUNCTION'
 )
 
 KEYWORDS = {
@@ -61,13 +95,31 @@ KEYWORDS = {
     '.': DOT,
     ':': COLON,
     ',': COMMA,
+    ':=': ASSIGN,
+    '=': EQUAL,
+    '<>': NOT_EQUAL,
+    '<': LESS_THAN,
+    '<=': LESS_EQUAL,
+    '>': GREATER_THAN,
+    '>=': GREATER_EQUAL,
+    '[': LBRACKET,
+    ']': RBRACKET,
+    '..': RANGE,
     PROGRAM: PROGRAM,
     VAR: VAR,
     INTEGER: INTEGER,
     REAL: REAL,
     BEGIN: BEGIN,
     END: END,
-    PROCEDURE: PROCEDURE
+    PROCEDURE: PROCEDURE,
+    WHILE: WHILE,
+    DO: DO,
+    FOR: FOR,
+    TO: TO,
+    DOWNTO: DOWNTO,
+    ARRAY: ARRAY,
+    OF: OF,
+    FUNCTION: FUNCTION
 }
 
 class Token(object):
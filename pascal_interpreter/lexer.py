@@ -1,5 +1,4 @@
-from .keywords import (INTEGER_CONST, FLOAT_CONST, EOF, ID, ASSIGN, KEYWORDS,
-    Token)
+from .keywords import INTEGER_CONST, FLOAT_CONST, EOF, ID, KEYWORDS, Token
 
 class Lexer(object):
     def __init__(self, text):
@@ -48,7 +47,8 @@ class Lexer(object):
             token_number += self.current_char
             self._advance_pos()
 
-            if self.current_char == '.':
+            # `1..10` is a subrange, not the float `1.`
+            if self.current_char == '.' and self._peek() != '.':
                 token_number += self.current_char
                 self._advance_pos()
                 while self._is_digit(self.current_char):
@@ -69,6 +69,13 @@ class Lexer(object):
         word = KEYWORDS.get(result, ID)
         return Token(word, result)
 
+    def __iter__(self):
+        '''yield the remaining tokens, not including EOF'''
+        token = self.get_next_token()
+        while token.type != EOF:
+            yield token
+            token = self.get_next_token()
+
     def get_next_token(self):
         '''Lexical analyser'''
         self._skip_whitespace()
@@ -83,9 +90,13 @@ class Lexer(object):
         if self.current_char.isdigit():
             return self._handle_number()
 
-        if self.current_char == ':' and self._peek() == '=':
+        # two-character operators (`:=`, `<>`, `<=`, `>=`, `..`)
+        next_char = self._peek()
+        if (next_char is not None and not self.current_char.isalpha()
+                and self.current_char + next_char in KEYWORDS):
+            value = self.current_char + next_char
             self._advance_pos(2)
-            return Token(ASSIGN, ':=')
+            return Token(KEYWORDS[value], value)
 
         if self.current_char in KEYWORDS:
             token = Token(KEYWORDS[self.current_char], self.current_char)
@@ -96,3 +107,19 @@ class Lexer(object):
             return self._handle_word()
 
         raise Exception('Error tokenizing input: {}'.format(self.current_char))
+
+class TokenStream(object):
+    '''
+    serves a list of tokens through the `get_next_token` interface of
+    `Lexer`, so that a `Parser` can consume pre-tokenized input
+    '''
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def get_next_token(self):
+        if self.pos >= len(self.tokens):
+            return Token(EOF, None)
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
@@ -0,0 +1,59 @@
+from .node_types import Var, IndexedVar, BinOp, UnaryOp, Num
+
+class NodeFactory(object):
+    '''
+    creates the expression nodes for `Parser`; every call returns a new
+    node
+    '''
+    def num(self, token):
+        return Num(token)
+
+    def var(self, token):
+        return Var(token)
+
+    def indexed_var(self, var_node, index):
+        return IndexedVar(var_node, index)
+
+    def bin_op(self, left, op, right):
+        return BinOp(left, op, right)
+
+    def unary_op(self, op, expr):
+        return UnaryOp(op, expr)
+
+class InterningNodeFactory(NodeFactory):
+    '''
+    hash-consing factory: structurally identical expression nodes are
+    created once and shared, so a program that mentions `x` or `1` many
+    times holds a single node for each, and two interned subtrees are
+    structurally equal if and only if they are the same object.
+    Children are interned before their parents, which lets parent keys
+    use the identity of their children instead of hashing whole subtrees.
+    Nodes created by this factory must not be mutated. Array elements
+    carry per-scope analysis results, so they are never shared.
+    '''
+    def __init__(self):
+        self._nodes = {}
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def _intern(self, key, create):
+        node = self._nodes.get(key)
+        if node is None:
+            node = self._nodes[key] = create()
+        return node
+
+    def num(self, token):
+        return self._intern((Num, token.type, token.value),
+            lambda: Num(token))
+
+    def var(self, token):
+        return self._intern((Var, token.value), lambda: Var(token))
+
+    def bin_op(self, left, op, right):
+        return self._intern((BinOp, op.type, id(left), id(right)),
+            lambda: BinOp(left, op, right))
+
+    def unary_op(self, op, expr):
+        return self._intern((UnaryOp, op.type, id(expr)),
+            lambda: UnaryOp(op, expr))
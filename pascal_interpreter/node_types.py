@@ -60,11 +60,25 @@ class VarDecl(ASTNode):
 
 class ProcedureDecl(ASTNode):
     '''
-    represents a procedure declaration
+    represents a procedure declaration. A lazily parsed procedure is
+    given `parse_body` instead of `block_node`; it is called the first
+    time `block_node` is read.
     '''
-    def __init__(self, proc_name, block_node):
+    def __init__(self, proc_name, block_node=None, parse_body=None):
         self.proc_name = proc_name
-        self.block_node = block_node
+        self._block_node = block_node
+        self._parse_body = parse_body
+
+    @property
+    def block_node(self):
+        if self._block_node is None:
+            self._block_node = self._parse_body()
+            self._parse_body = None
+        return self._block_node
+
+    @property
+    def is_parsed(self):
+        return self._block_node is not None
 
     def __str__(self):
         return '{}: {}'.format(self.proc_name, self.block_node)
@@ -72,6 +86,34 @@ class ProcedureDecl(ASTNode):
     def accept(self, visitor):
         return visitor.visit_proc_decl(self)
 
+class FunctionDecl(ASTNode):
+    '''
+    represents a function declaration; `params` is a list of `VarDecl`.
+    Semantic analysis fills in `enclosing` (the enclosing `FunctionDecl`
+    or `None`), `local_names`, `writes` (non-local variables the function
+    may assign, including through its callees) and `pure`.
+    '''
+    def __init__(self, func_name, params, return_type, block_node):
+        self.func_name = func_name
+        self.params = params
+        self.return_type = return_type
+        self.block_node = block_node
+        self.enclosing = None
+        self.local_names = None
+        self.writes = None
+        self.pure = None
+
+    def __str__(self):
+        return '{}({}): {}: {}'.format(
+            self.func_name,
+            ', '.join(map(str, self.params)),
+            self.return_type,
+            self.block_node
+        )
+
+    def accept(self, visitor):
+        return visitor.visit_func_decl(self)
+
 class Type(ASTNode):
     '''
     represents a variable type
@@ -83,6 +125,23 @@ class Type(ASTNode):
     def __str__(self):
         return self.value
 
+class ArrayType(ASTNode):
+    '''
+    represents an ARRAY [lo..hi] OF type
+    '''
+    def __init__(self, lo, hi, element_type):
+        self.lo = lo
+        self.hi = hi
+        self.element_type = element_type
+        self.value = 'ARRAY[{}..{}] OF {}'.format(lo, hi, element_type)
+
+    @property
+    def length(self):
+        return self.hi - self.lo + 1
+
+    def __str__(self):
+        return self.value
+
 class CompoundStatement(ASTNode):
     '''
     represents a BEGIN..END block
@@ -115,6 +174,65 @@ class AssignmentStatement(ASTNode):
     def accept(self, visitor):
         return visitor.visit_assignment(self)
 
+class IndexedAssignmentStatement(ASTNode):
+    '''
+    represents an assignment to an array element
+    '''
+    def __init__(self, left, op, right):
+        self.left = left
+        self.token = self.op = op
+        self.right = right
+
+    def __str__(self):
+        return '({left} {op} {right})'.format(
+            left=str(self.left),
+            op=self.op.value,
+            right=str(self.right)
+        )
+
+    def accept(self, visitor):
+        return visitor.visit_indexed_assignment(self)
+
+class WhileStatement(ASTNode):
+    '''
+    represents a WHILE..DO loop
+    '''
+    def __init__(self, condition, body):
+        self.condition = condition
+        self.body = body
+
+    def __str__(self):
+        return 'WHILE {condition} DO {body}'.format(
+            condition=self.condition,
+            body=self.body
+        )
+
+    def accept(self, visitor):
+        return visitor.visit_while(self)
+
+class ForStatement(ASTNode):
+    '''
+    represents a counted FOR..TO/DOWNTO..DO loop
+    '''
+    def __init__(self, var_node, start, direction, end, body):
+        self.var_node = var_node
+        self.start = start
+        self.token = self.direction = direction
+        self.end = end
+        self.body = body
+
+    def __str__(self):
+        return 'FOR {var} := {start} {direction} {end} DO {body}'.format(
+            var=self.var_node,
+            start=self.start,
+            direction=self.direction.value,
+            end=self.end,
+            body=self.body
+        )
+
+    def accept(self, visitor):
+        return visitor.visit_for(self)
+
 class Var(ASTNode):
     '''
     represents a variable
@@ -131,6 +249,46 @@ class Var(ASTNode):
     def accept(self, visitor):
         return visitor.visit_var(self)
 
+class IndexedVar(ASTNode):
+    '''
+    represents an array element. `lo`, `length` and `check` are filled in
+    by semantic analysis; `check` is `False` when the index is proven to
+    be in bounds.
+    '''
+    def __init__(self, var_node, index):
+        self.var_node = var_node
+        self.index = index
+        self.value = var_node.value
+        self.lo = None
+        self.length = None
+        self.check = None
+
+    def __str__(self):
+        return '{value}[{index}]'.format(value=self.value, index=self.index)
+
+    def accept(self, visitor):
+        return visitor.visit_indexed_var(self)
+
+class FunctionCall(ASTNode):
+    '''
+    represents a function call; `function` is set to the called
+    `FunctionDecl` by semantic analysis
+    '''
+    def __init__(self, token, args):
+        self.token = token
+        self.value = token.value
+        self.args = args
+        self.function = None
+
+    def __str__(self):
+        return '{value}({args})'.format(
+            value=self.value,
+            args=', '.join(map(str, self.args))
+        )
+
+    def accept(self, visitor):
+        return visitor.visit_function_call(self)
+
 class NoOp(ASTNode):
     '''
     represents an empty statement
@@ -190,3 +348,33 @@ class Num(ASTNode):
 
     def accept(self, visitor):
         return visitor.visit_num(self)
+
+class TempStore(ASTNode):
+    '''
+    represents an expression whose value is saved in a temporary slot
+    for reuse (introduced by the optimizer, never by the parser)
+    '''
+    def __init__(self, slot, expr):
+        self.slot = slot
+        self.expr = expr
+
+    def __str__(self):
+        return '($T{slot} = {expr})'.format(slot=self.slot, expr=self.expr)
+
+    def accept(self, visitor):
+        return visitor.visit_temp_store(self)
+
+class TempLoad(ASTNode):
+    '''
+    represents a reuse of a value saved by a `TempStore`; `expr` is the
+    expression it replaced, kept for display only
+    '''
+    def __init__(self, slot, expr):
+        self.slot = slot
+        self.expr = expr
+
+    def __str__(self):
+        return '$T{slot}'.format(slot=self.slot)
+
+    def accept(self, visitor):
+        return visitor.visit_temp_load(self)
@@ -0,0 +1,299 @@
+from .keywords import FLOAT_DIV, INTEGER_DIV
+from .node_types import (AssignmentStatement, Var, NoOp, BinOp, UnaryOp, Num,
+    TempStore, TempLoad)
+from .visitor import Visitor
+
+class OptimizationReport(object):
+    '''
+    records what an `Optimizer` pass eliminated
+    '''
+    def __init__(self):
+        self.subexpressions = []
+        self.dead_stores = []
+
+    def __str__(self):
+        lines = ['Eliminated {} common subexpression(s), {} dead store(s)'.format(
+            len(self.subexpressions), len(self.dead_stores))]
+        lines.extend('CSE: {}'.format(expr) for expr in self.subexpressions)
+        lines.extend('DSE: {}'.format(stmt) for stmt in self.dead_stores)
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return self.__str__()
+
+class _ValueNumbering(object):
+    '''
+    local value numbering for one run of straight-line assignments.
+    Variables are versioned so that an assignment invalidates every
+    expression that read the old value.
+    '''
+    def __init__(self):
+        self.numbers = {}
+        self.versions = {}
+
+    def _number(self, key):
+        return self.numbers.setdefault(key, len(self.numbers))
+
+    def kill(self, name):
+        self.versions[name] = self.versions.get(name, 0) + 1
+
+    def number_expr(self, node, memo):
+        '''
+        return the value number of `node` (or `None` if it cannot be
+        numbered) and record the numbers of its subexpressions in `memo`
+        '''
+        if isinstance(node, Num):
+            vn = self._number(('NUM', node.token.type, node.value))
+        elif isinstance(node, Var):
+            vn = self._number(
+                ('VAR', node.value, self.versions.get(node.value, 0)))
+        elif isinstance(node, BinOp):
+            left = self.number_expr(node.left, memo)
+            right = self.number_expr(node.right, memo)
+            vn = None
+            if left is not None and right is not None:
+                vn = self._number((node.op.type, left, right))
+        elif isinstance(node, UnaryOp):
+            operand = self.number_expr(node.expr, memo)
+            vn = None
+            if operand is not None:
+                vn = self._number((node.op.type, operand))
+        else:
+            vn = None
+        memo[id(node)] = vn
+        return vn
+
+def _reads(node):
+    '''
+    return the set of variable names read by an expression, or `None`
+    if the expression contains nodes the optimizer does not understand
+    '''
+    if isinstance(node, Num):
+        return set()
+    if isinstance(node, Var):
+        return {node.value}
+    if isinstance(node, BinOp):
+        left, right = _reads(node.left), _reads(node.right)
+        if left is None or right is None:
+            return None
+        return left | right
+    if isinstance(node, UnaryOp):
+        return _reads(node.expr)
+    return None
+
+def _may_raise(node, defined):
+    '''
+    division may fail on any operands, and so may arithmetic on a variable
+    that was never assigned (its value is `None`); stores whose value may
+    raise are never removed. `defined` holds the names known to hold a
+    number at this point.
+    '''
+    if isinstance(node, BinOp):
+        if node.op.type in (FLOAT_DIV, INTEGER_DIV):
+            if not isinstance(node.right, Num) or node.right.value == 0:
+                return True
+        operands = (node.left, node.right)
+    elif isinstance(node, UnaryOp):
+        operands = (node.expr,)
+    else:
+        return not isinstance(node, (Num, Var))
+    return any(operand.value not in defined if isinstance(operand, Var)
+        else _may_raise(operand, defined) for operand in operands)
+
+def _defined_names(statements):
+    '''
+    return, for each statement of a run, the names that are definitely
+    assigned a number by earlier statements of the run. Only plain
+    assignments whose reads are all defined define a name; any other
+    statement may assign anything (function calls included), so it
+    forgets everything.
+    '''
+    result = []
+    defined = frozenset()
+    for statement in statements:
+        result.append(defined)
+        if isinstance(statement, NoOp):
+            continue
+        reads = None
+        if isinstance(statement, AssignmentStatement):
+            reads = _reads(statement.right)
+        if reads is None:
+            defined = frozenset()
+        elif reads <= defined:
+            defined = defined | {statement.left.value}
+        else:
+            defined = defined - {statement.left.value}
+    return result
+
+class Optimizer(Visitor):
+    '''
+    rewrites every statement list in the tree in place:
+    * dead-store elimination drops assignments that are overwritten
+      before they are read
+    * common-subexpression elimination saves the first evaluation of
+      a repeated `BinOp`/`UnaryOp` in a temporary and reuses it
+    Both work on runs of consecutive assignments to scalar variables; any
+    other statement (including assignments to array elements) is treated
+    as reading and writing every variable. Assignments that
+    are still live at the end of a run are kept, so the final scope is
+    unchanged. Run it after `SymbolTableBuilderVisitor` so that removed
+    statements are still checked.
+    '''
+    def __init__(self):
+        super(Optimizer, self).__init__()
+        self.report = OptimizationReport()
+        self._next_slot = 0
+
+    def visit_program(self, node):
+        node.block.accept(self)
+        return self.report
+
+    def visit_block(self, node):
+        for declaration in node.declarations:
+            declaration.accept(self)
+        node.compound_statement.accept(self)
+
+    def visit_func_decl(self, node):
+        node.block_node.accept(self)
+
+    def visit_proc_decl(self, node):
+        # lazily parsed bodies are left alone rather than parsed here
+        if node.is_parsed:
+            node.block_node.accept(self)
+
+    def visit_compound_statement(self, node):
+        for child in node.children:
+            child.accept(self)
+        statements = self._eliminate_dead_stores(node.children)
+        node.children = self._eliminate_subexpressions(statements)
+
+    def visit_assignment(self, node):
+        pass
+
+    def visit_indexed_assignment(self, node):
+        pass
+
+    def visit_while(self, node):
+        node.body.accept(self)
+
+    def visit_for(self, node):
+        node.body.accept(self)
+
+    def _eliminate_dead_stores(self, statements):
+        kept = []
+        overwritten = set()
+        for statement, defined in reversed(
+                list(zip(statements, _defined_names(statements)))):
+            if isinstance(statement, NoOp):
+                kept.append(statement)
+                continue
+            if not isinstance(statement, AssignmentStatement):
+                overwritten = set()
+                kept.append(statement)
+                continue
+
+            name = statement.left.value
+            reads = _reads(statement.right)
+            if (name in overwritten and reads is not None
+                    and not _may_raise(statement.right, defined)):
+                self.report.dead_stores.append(statement)
+                continue
+
+            overwritten.add(name)
+            if reads is None or _may_raise(statement.right, defined):
+                # if this statement raises, the stores before it are the
+                # final values, so none of them may be removed
+                overwritten = set()
+            else:
+                overwritten -= reads
+            kept.append(statement)
+
+        kept.reverse()
+        return kept
+
+    def _eliminate_subexpressions(self, statements):
+        result = []
+        run = []
+        for statement in statements:
+            # function calls may write any variable, so an assignment that
+            # makes one ends the run
+            if isinstance(statement, NoOp) or (
+                    isinstance(statement, AssignmentStatement)
+                    and _reads(statement.right) is not None):
+                run.append(statement)
+            else:
+                result.extend(self._number_run(run))
+                result.append(statement)
+                run = []
+        result.extend(self._number_run(run))
+        return result
+
+    def _number_run(self, statements):
+        run = [stmt for stmt in statements
+            if isinstance(stmt, AssignmentStatement)]
+        if len(run) < 2:
+            return statements
+        numbering = _ValueNumbering()
+        memos = []
+        counts = {}
+        for statement in run:
+            memo = {}
+            numbering.number_expr(statement.right, memo)
+            self._count(statement.right, memo, counts)
+            memos.append(memo)
+            numbering.kill(statement.left.value)
+
+        if not any(count > 1 for count in counts.values()):
+            return statements
+
+        slots = {}
+        rewritten = []
+        for statement, memo in zip(run, memos):
+            right = self._rewrite(statement.right, memo, counts, slots)
+            if right is not statement.right:
+                statement = AssignmentStatement(
+                    statement.left, statement.op, right)
+            rewritten.append(statement)
+        return rewritten
+
+    def _count(self, node, memo, counts):
+        if isinstance(node, (BinOp, UnaryOp)):
+            vn = memo[id(node)]
+            if vn is not None:
+                counts[vn] = counts.get(vn, 0) + 1
+                if counts[vn] > 1:
+                    return
+        if isinstance(node, BinOp):
+            self._count(node.left, memo, counts)
+            self._count(node.right, memo, counts)
+        elif isinstance(node, UnaryOp):
+            self._count(node.expr, memo, counts)
+
+    def _rewrite(self, node, memo, counts, slots):
+        '''
+        return `node` with repeated subexpressions replaced; nodes are
+        copied rather than mutated since subtrees may be shared
+        '''
+        if not isinstance(node, (BinOp, UnaryOp)):
+            return node
+
+        vn = memo[id(node)]
+        if vn is not None and counts.get(vn, 0) > 1 and vn in slots:
+            self.report.subexpressions.append(node)
+            return TempLoad(slots[vn], node)
+
+        if isinstance(node, BinOp):
+            left = self._rewrite(node.left, memo, counts, slots)
+            right = self._rewrite(node.right, memo, counts, slots)
+            if left is not node.left or right is not node.right:
+                node = BinOp(left, node.op, right)
+        else:
+            expr = self._rewrite(node.expr, memo, counts, slots)
+            if expr is not node.expr:
+                node = UnaryOp(node.op, expr)
+
+        if vn is not None and counts.get(vn, 0) > 1:
+            slots[vn] = self._next_slot
+            self._next_slot += 1
+            node = TempStore(slots[vn], node)
+        return node
@@ -0,0 +1,76 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .keywords import EOF, Token
+from .lexer import Lexer
+
+def find_split_points(text, chunks):
+    '''
+    return up to `chunks - 1` offsets at which `text` can be cut without
+    changing how it tokenizes: each offset follows a `;` that is not
+    inside a `{ ... }` comment. `;` is always a token of its own, so no
+    token can span a split point.
+    '''
+    points = []
+    size = len(text)
+    pos = 0  # always outside a comment
+    for k in range(1, chunks):
+        target = max(pos, size * k // chunks)
+        while True:
+            semi = text.find(';', target)
+            if semi == -1:
+                return points
+            comment = text.find('{', pos, semi)
+            if comment == -1:
+                break
+            end = text.find('}', comment)
+            if end == -1:
+                return points
+            pos = end + 1
+            target = max(target, pos)
+        pos = semi + 1
+        points.append(pos)
+    return points
+
+def _tokenize_chunk(text):
+    # plain tuples are much cheaper than `Token`s to send between processes
+    return [(token.type, token.value) for token in Lexer(text)]
+
+def tokenize(text):
+    '''sequentially tokenize `text`; the result ends with the EOF token'''
+    tokens = list(Lexer(text))
+    tokens.append(Token(EOF, None))
+    return tokens
+
+def parallel_tokenize(text, workers=None, chunks=None, min_chunk_size=65536,
+        executor=None):
+    '''
+    tokenize `text` in a process pool and return the same token list as
+    `tokenize`. The text is cut into `chunks` pieces (default four per
+    worker, never smaller than `min_chunk_size` characters) at safe split
+    points. An existing `executor` may be passed to avoid starting a new
+    pool for every call.
+    '''
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 and executor is None:
+        return tokenize(text)
+    if chunks is None:
+        chunks = workers * 4
+    chunks = min(chunks, len(text) // max(min_chunk_size, 1))
+    points = find_split_points(text, chunks) if chunks > 1 else []
+    if not points:
+        return tokenize(text)
+
+    bounds = [0] + points + [len(text)]
+    pieces = [text[start:end] for start, end in zip(bounds, bounds[1:])
+        if start < end]
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_tokenize_chunk, pieces))
+    else:
+        results = list(executor.map(_tokenize_chunk, pieces))
+
+    tokens = [Token(type, value) for result in results
+        for type, value in result]
+    tokens.append(Token(EOF, None))
+    return tokens
@@ -1,18 +1,51 @@
 from .keywords import (INTEGER_CONST, FLOAT_CONST, PLUS, MINUS, MUL, FLOAT_DIV,
     INTEGER_DIV, LPAREN, RPAREN, EOF, PROGRAM, VAR, INTEGER, REAL, BEGIN, END,
-    ID, ASSIGN, SEMI, DOT, COLON, COMMA, PROCEDURE)
+    ID, ASSIGN, SEMI, DOT, COLON, COMMA, PROCEDURE, WHILE, DO, FOR, TO, DOWNTO,
+    EQUAL, NOT_EQUAL, LESS_THAN, LESS_EQUAL, GREATER_THAN, GREATER_EQUAL,
+    ARRAY, OF, LBRACKET, RBRACKET, RANGE, FUNCTION, Token)
 
-from .node_types import (Program, Block, VarDecl, ProcedureDecl, Type,
-    CompoundStatement, AssignmentStatement, Var, NoOp, BinOp, UnaryOp, Num)
+from .node_factory import NodeFactory
+from .node_types import (Program, Block, VarDecl, ProcedureDecl,
+    FunctionDecl, Type, ArrayType, CompoundStatement, AssignmentStatement,
+    IndexedAssignmentStatement, WhileStatement, ForStatement, IndexedVar,
+    FunctionCall, NoOp)
+from .lexer import TokenStream
+
+COMPARISON_OPS = (EQUAL, NOT_EQUAL, LESS_THAN, LESS_EQUAL, GREATER_THAN,
+    GREATER_EQUAL)
 
 class Parser(object):
-    def __init__(self, lexer):
+    '''
+    `factory` creates the expression nodes; pass an
+    `InterningNodeFactory` to share identical subtrees.
+    With `lazy_procedures`, procedure bodies are only skipped over and
+    their tokens saved; each body is parsed the first time its
+    `ProcedureDecl.block_node` is used, so syntax errors in a body are
+    reported then rather than by `parse`.
+    '''
+    def __init__(self, lexer, factory=None, lazy_procedures=False):
         self.lexer = lexer
+        self.factory = factory if factory is not None else NodeFactory()
+        self.lazy_procedures = lazy_procedures
+        # the token after `current_token`, once `peek` has read it
+        self._next_token = None
         self.current_token = self.lexer.get_next_token()
 
+    def _advance(self):
+        if self._next_token is not None:
+            self.current_token, self._next_token = self._next_token, None
+        else:
+            self.current_token = self.lexer.get_next_token()
+
+    def peek(self):
+        '''return the token after `current_token` without consuming it'''
+        if self._next_token is None:
+            self._next_token = self.lexer.get_next_token()
+        return self._next_token
+
     def eat(self, token_type):
         if self.current_token.type == token_type:
-            self.current_token = self.lexer.get_next_token()
+            self._advance()
         else:
             raise Exception('Expected {}, got {}: {}'.format(token_type,
                 self.current_token.type, self.current_token))
@@ -42,39 +75,142 @@ class Parser(object):
     def declarations(self):
         '''
         declarations: VAR (variable_declaration SEMI)+
-                    | (PROCEDURE ID SEMI block SEMI)*
+                    | (PROCEDURE ID SEMI block SEMI
+                      | function_declaration)*
                     | empty
+        The VAR section ends at the first ID that is not followed by COMMA
+        or COLON, so that a fragment may continue with statements.
         '''
         declarations = []
         if self.current_token.type == VAR:
             self.eat(VAR)
-            while self.current_token.type == ID:
+            while (self.current_token.type == ID
+                    and self.peek().type in (COMMA, COLON)):
                 var_decl = self.variable_declaration()
                 declarations.extend(var_decl)
                 self.eat(SEMI)
 
-        while self.current_token.type == PROCEDURE:
+        while self.current_token.type in (PROCEDURE, FUNCTION):
+            if self.current_token.type == FUNCTION:
+                declarations.append(self.function_declaration())
+                continue
+
             self.eat(PROCEDURE)
             proc_name = self.current_token.value
             self.eat(ID)
             self.eat(SEMI)
-            block_node = self.block()
-            proc_decl = ProcedureDecl(proc_name, block_node)
+            if self.lazy_procedures:
+                proc_decl = ProcedureDecl(proc_name,
+                    parse_body=self._deferred_block(self._skip_block([])))
+            else:
+                proc_decl = ProcedureDecl(proc_name, self.block())
             declarations.append(proc_decl)
             self.eat(SEMI)
 
         return declarations
 
+    def function_declaration(self):
+        '''
+        function_declaration: FUNCTION ID
+                              (LPAREN formal_parameter_list RPAREN)?
+                              COLON type_spec SEMI block SEMI
+        '''
+        self.eat(FUNCTION)
+        func_name = self.current_token.value
+        self.eat(ID)
+        params = []
+        if self.current_token.type == LPAREN:
+            self.eat(LPAREN)
+            params = self.formal_parameter_list()
+            self.eat(RPAREN)
+        self.eat(COLON)
+        return_type = self.scalar_type_spec()
+        self.eat(SEMI)
+        block_node = self.block()
+        self.eat(SEMI)
+        return FunctionDecl(func_name, params, return_type, block_node)
+
+    def formal_parameter_list(self):
+        '''
+        formal_parameter_list: formal_parameters (SEMI formal_parameters)*
+        formal_parameters: ID (COMMA ID)* COLON (INTEGER|REAL)
+        '''
+        params = self.variable_declaration()
+        while self.current_token.type == SEMI:
+            self.eat(SEMI)
+            params.extend(self.variable_declaration())
+        for param in params:
+            if isinstance(param.type_node, ArrayType):
+                raise Exception('Parameter {} must be INTEGER or REAL'.format(
+                    param.var_node))
+        return params
+
+    def _skip(self, tokens):
+        tokens.append(self.current_token)
+        self._advance()
+
+    def _skip_block(self, tokens):
+        '''
+        append the tokens of a `block` to `tokens` without parsing it:
+        everything up to the first BEGIN outside a nested procedure or
+        function, then up to its matching END
+        '''
+        while self.current_token.type != BEGIN:
+            if self.current_token.type == EOF:
+                raise Exception('Expected {}, got {}'.format(BEGIN, EOF))
+            if self.current_token.type in (PROCEDURE, FUNCTION):
+                # the heading runs to the first SEMI outside the parameter
+                # list, then comes the nested block
+                depth = 0
+                while depth or self.current_token.type != SEMI:
+                    if self.current_token.type == EOF:
+                        raise Exception('Expected {}, got {}'.format(SEMI, EOF))
+                    if self.current_token.type == LPAREN:
+                        depth += 1
+                    elif self.current_token.type == RPAREN:
+                        depth -= 1
+                    self._skip(tokens)
+                self._skip(tokens)
+                self._skip_block(tokens)
+            else:
+                self._skip(tokens)
+
+        depth = 0
+        while True:
+            token_type = self.current_token.type
+            if token_type == EOF:
+                raise Exception('Expected {}, got {}'.format(END, EOF))
+            self._skip(tokens)
+            if token_type == BEGIN:
+                depth += 1
+            elif token_type == END:
+                depth -= 1
+                if depth == 0:
+                    return tokens
+
+    def _deferred_block(self, tokens):
+        tokens.append(Token(EOF, None))
+
+        def parse_body():
+            parser = Parser(TokenStream(tokens), self.factory,
+                self.lazy_procedures)
+            node = parser.block()
+            if parser.current_token.type != EOF:
+                raise Exception('Parser did not reach end of procedure body')
+            return node
+
+        return parse_body
+
     def variable_declaration(self):
         '''
         variable_declaration: ID (COMMA ID)* COLON type_spec
         '''
-        var_nodes = [Var(self.current_token)]
+        var_nodes = [self.factory.var(self.current_token)]
         self.eat(ID)
 
         while self.current_token.type == COMMA:
             self.eat(COMMA)
-            var_nodes.append(Var(self.current_token))
+            var_nodes.append(self.factory.var(self.current_token))
             self.eat(ID)
 
         self.eat(COLON)
@@ -86,7 +222,11 @@ class Parser(object):
         '''
         type_spec: INTEGER
                  | REAL
+                 | array_type
         '''
+        if self.current_token.type == ARRAY:
+            return self.array_type()
+
         token = self.current_token
         if self.current_token.type == INTEGER:
             self.eat(INTEGER)
@@ -95,6 +235,46 @@ class Parser(object):
 
         return Type(token)
 
+    def scalar_type_spec(self):
+        '''
+        scalar_type_spec: INTEGER
+                        | REAL
+        '''
+        if self.current_token.type not in (INTEGER, REAL):
+            raise Exception('Expected INTEGER or REAL, got {}'.format(
+                self.current_token))
+        return self.type_spec()
+
+    def array_type(self):
+        '''
+        array_type: ARRAY LBRACKET constant RANGE constant RBRACKET
+                    OF (INTEGER|REAL)
+        '''
+        self.eat(ARRAY)
+        self.eat(LBRACKET)
+        lo = self.constant()
+        self.eat(RANGE)
+        hi = self.constant()
+        self.eat(RBRACKET)
+        self.eat(OF)
+        element_type = self.scalar_type_spec()
+        if hi < lo:
+            raise Exception('Invalid array bounds [{}..{}]'.format(lo, hi))
+        return ArrayType(lo, hi, element_type)
+
+    def constant(self):
+        '''
+        constant: (PLUS|MINUS)? INTEGER_CONST
+        '''
+        sign = 1
+        if self.current_token.type in (PLUS, MINUS):
+            if self.current_token.type == MINUS:
+                sign = -1
+            self.eat(self.current_token.type)
+        value = self.current_token.value
+        self.eat(INTEGER_CONST)
+        return sign * value
+
     def compound_statement(self):
         '''
         compound_statement: BEGIN statement_list END
@@ -130,38 +310,115 @@ class Parser(object):
         '''
         statement: compound_statement
                  | assignment_statement
+                 | while_statement
+                 | for_statement
                  | empty
         '''
         if self.current_token.type == BEGIN:
             node = self.compound_statement()
         elif self.current_token.type == ID:
             node = self.assignment_statement()
+        elif self.current_token.type == WHILE:
+            node = self.while_statement()
+        elif self.current_token.type == FOR:
+            node = self.for_statement()
         else:
             node = self.empty()
         return node
 
     def assignment_statement(self):
         '''
-        assignment_statement: variable ASSIGN expr
+        assignment_statement: variable_access ASSIGN expr
         '''
-        left = self.variable()
+        left = self.variable_access()
         token = self.current_token
         self.eat(ASSIGN)
         right = self.expr()
+        if isinstance(left, IndexedVar):
+            return IndexedAssignmentStatement(left, token, right)
         node = AssignmentStatement(left, token, right)
         return node
 
+    def while_statement(self):
+        '''
+        while_statement: WHILE expr DO statement
+        '''
+        self.eat(WHILE)
+        condition = self.expr()
+        self.eat(DO)
+        body = self.statement()
+        return WhileStatement(condition, body)
+
+    def for_statement(self):
+        '''
+        for_statement: FOR variable ASSIGN expr (TO|DOWNTO) expr DO statement
+        '''
+        self.eat(FOR)
+        var_node = self.variable()
+        self.eat(ASSIGN)
+        start = self.expr()
+        direction = self.current_token
+        if direction.type == DOWNTO:
+            self.eat(DOWNTO)
+        else:
+            self.eat(TO)
+        end = self.expr()
+        self.eat(DO)
+        body = self.statement()
+        return ForStatement(var_node, start, direction, end, body)
+
     def variable(self):
         '''
         variable: ID
         '''
-        node = Var(self.current_token)
+        node = self.factory.var(self.current_token)
         self.eat(ID)
         return node
 
+    def variable_access(self, node=None):
+        '''
+        variable_access: variable (LBRACKET expr RBRACKET)?
+        '''
+        if node is None:
+            node = self.variable()
+        if self.current_token.type == LBRACKET:
+            self.eat(LBRACKET)
+            index = self.expr()
+            self.eat(RBRACKET)
+            node = self.factory.indexed_var(node, index)
+        return node
+
+    def function_call(self, var_node):
+        '''
+        function_call: variable LPAREN (expr (COMMA expr)*)? RPAREN
+        '''
+        args = []
+        self.eat(LPAREN)
+        if self.current_token.type != RPAREN:
+            args.append(self.expr())
+            while self.current_token.type == COMMA:
+                self.eat(COMMA)
+                args.append(self.expr())
+        self.eat(RPAREN)
+        return FunctionCall(var_node.token, args)
+
     def expr(self):
         '''
-        expr: term((PLUS|MINUS)term)*
+        expr: simple_expr ((EQUAL|NOT_EQUAL|LESS_THAN|LESS_EQUAL
+                           |GREATER_THAN|GREATER_EQUAL) simple_expr)?
+        '''
+        node = self.simple_expr()
+
+        if self.current_token.type in COMPARISON_OPS:
+            token = self.current_token
+            self.eat(token.type)
+            node = self.factory.bin_op(node, token, self.simple_expr())
+
+        return node
+
+    def simple_expr(self):
+        '''
+        simple_expr: term((PLUS|MINUS)term)*
         '''
         node = self.term()
 
@@ -171,7 +428,7 @@ class Parser(object):
                 self.eat(PLUS)
             elif token.type == MINUS:
                 self.eat(MINUS)
-            node = BinOp(node, token, self.term())
+            node = self.factory.bin_op(node, token, self.term())
 
         return node
 
@@ -189,7 +446,7 @@ class Parser(object):
                 self.eat(FLOAT_DIV)
             elif token.type == INTEGER_DIV:
                 self.eat(INTEGER_DIV)
-            node = BinOp(node, token, self.factor())
+            node = self.factory.bin_op(node, token, self.factor())
 
         return node
 
@@ -199,20 +456,21 @@ class Parser(object):
               | MINUS factor
               | INTEGER_CONST
               | LPAREN expr RPAREN
-              | variable
+              | function_call
+              | variable_access
         '''
         token = self.current_token
         if token.type == PLUS:
             self.eat(PLUS)
-            node = UnaryOp(token, self.factor())
+            node = self.factory.unary_op(token, self.factor())
         elif token.type == MINUS:
             self.eat(MINUS)
-            node = UnaryOp(token, self.factor())
+            node = self.factory.unary_op(token, self.factor())
         elif token.type == INTEGER_CONST:
             self.eat(INTEGER_CONST)
-            node = Num(token)
+            node = self.factory.num(token)
         elif token.type == FLOAT_CONST:
-            node = Num(token)
+            node = self.factory.num(token)
             self.eat(FLOAT_CONST)
         elif token.type == LPAREN:
             self.eat(LPAREN)
@@ -220,6 +478,10 @@ class Parser(object):
             self.eat(RPAREN)
         else:
             node = self.variable()
+            if self.current_token.type == LPAREN:
+                node = self.function_call(node)
+            else:
+                node = self.variable_access(node)
         return node
 
     def empty(self):
@@ -228,6 +490,25 @@ class Parser(object):
         '''
         return NoOp()
 
+    def fragment(self):
+        '''
+        fragment: declarations statement_list
+        '''
+        declaration_nodes = self.declarations()
+        root = CompoundStatement()
+        root.children.extend(self.statement_list())
+        return Block(declaration_nodes, root)
+
+    def parse_fragment(self):
+        '''
+        parse a piece of a program (as typed into the REPL) rather than a
+        complete PROGRAM
+        '''
+        node = self.fragment()
+        if self.current_token.type != EOF:
+            raise Exception('Parser did not reach end of input')
+        return node
+
     def parse(self):
         node = self.program()
         if self.current_token.type != EOF:
@@ -0,0 +1,48 @@
+from .interpreter import Interpreter
+from .lexer import Lexer
+from .optimizer import Optimizer
+from .parser import Parser
+from .symbol_table import SymbolTableBuilderVisitor, assigned_names
+from .visitor import Visitor
+
+class Session(object):
+    '''
+    an interactive session: the symbol table and variable frame persist
+    between calls to `execute`, and each call lexes, parses, analyses and
+    runs only the new fragment (declarations and/or statements), so the
+    cost of an input does not depend on how long the session has been
+    running. With `optimize`, each fragment is passed through `Optimizer`
+    after analysis.
+    '''
+    def __init__(self, optimize=False):
+        self.symtable_builder = SymbolTableBuilderVisitor()
+        self.visitor = Visitor()
+        self.optimize = optimize
+
+    @property
+    def symtable(self):
+        return self.symtable_builder.symtable
+
+    @property
+    def scope(self):
+        return self.visitor.scope
+
+    def execute(self, text):
+        '''
+        run one fragment and return the names it assigned, in order
+        '''
+        tree = Parser(Lexer(text)).parse_fragment()
+        interpreter = Interpreter(tree)
+        # a fragment that fails analysis must not leave any of its
+        # declarations behind, since it is never executed
+        symbols = self.symtable.snapshot()
+        try:
+            interpreter.interpret(self.symtable_builder)
+        except Exception:
+            self.symtable.restore(symbols)
+            raise
+        if self.optimize:
+            interpreter.interpret(Optimizer())
+        interpreter.interpret(self.visitor)
+        names = assigned_names(tree.compound_statement)
+        return list(dict.fromkeys(names))
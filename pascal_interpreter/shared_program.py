@@ -0,0 +1,474 @@
+import operator
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from .environment import Environment, FunctionCache
+from .keywords import (PLUS, MINUS, MUL, FLOAT_DIV, INTEGER_DIV, DOWNTO,
+    EQUAL, NOT_EQUAL, LESS_THAN, LESS_EQUAL, GREATER_THAN, GREATER_EQUAL,
+    INTEGER, REAL, FLOAT_CONST)
+from .node_types import ArrayType
+from .visitor import Visitor
+
+MAGIC = int.from_bytes(b'PASTREE\x00', 'little')
+VERSION = 2
+# header words: magic, version, root offset, number of global slots,
+# number of scopes, byte offset and byte length of the name table
+HEADER_WORDS = 7
+
+# node kinds; every node is a run of 64-bit words starting with its kind,
+# and children are referred to by their word offset. A variable is a
+# (scope, slot) pair: scope 0 holds the globals and each function has a
+# scope of its own.
+(PROGRAM, BLOCK, COMPOUND, ASSIGN, INDEXED_ASSIGN, WHILE, FOR, NO_OP,
+    INT, REAL_NUM, VAR, INDEXED_VAR, BIN_OP, UNARY_OP, TEMP_STORE,
+    TEMP_LOAD, FUNCTION, CALL) = range(18)
+
+_BINARY_OPS = (PLUS, MINUS, MUL, FLOAT_DIV, INTEGER_DIV, EQUAL, NOT_EQUAL,
+    LESS_THAN, LESS_EQUAL, GREATER_THAN, GREATER_EQUAL)
+_BINARY_FUNCS = (operator.add, operator.sub, operator.mul, operator.truediv,
+    operator.floordiv, operator.eq, operator.ne, operator.lt, operator.le,
+    operator.gt, operator.ge)
+_UNARY_OPS = (PLUS, MINUS)
+_UNARY_FUNCS = (operator.pos, operator.neg)
+_TYPECODES = ('q', 'd')
+
+_REAL_BITS = struct.Struct('=d')
+_WORD = struct.Struct('=q')
+
+# the value of a global that has not been assigned; unlike `None`, which
+# a program can assign, it never appears in the reported scope
+_UNASSIGNED = object()
+
+class _Encoder(Visitor):
+    '''
+    flattens an analysed tree into an `array('q')` of words. Each
+    variable is resolved to the scope that declares it. Global slots are
+    the ids of their names in the name table. Nodes shared by the tree
+    (for example by `InterningNodeFactory`) are encoded once per scope.
+    '''
+    def __init__(self):
+        super(_Encoder, self).__init__()
+        self.words = array('q', bytes(8 * HEADER_WORDS))
+        self.names = {}
+        self.scope_count = 1
+        # the FunctionDecl being encoded, and scope id and
+        # {name: slot} of every function seen so far
+        self._function = None
+        self._scopes = {}
+        self._functions = {}
+        self._offsets = {}
+
+    def encode(self, node):
+        key = id(node), self._function
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._offsets[key] = node.accept(self)
+        return offset
+
+    def _emit(self, *words):
+        offset = len(self.words)
+        try:
+            self.words.extend(words)
+        except OverflowError:
+            raise ValueError('{} does not fit in 64 bits'.format(words))
+        return offset
+
+    def _name_id(self, name):
+        return self.names.setdefault(name, len(self.names))
+
+    def _variable(self, name):
+        '''return the (scope, slot) of `name` where it is used'''
+        function = self._function
+        while function is not None:
+            scope, slots = self._scopes[function]
+            if name in slots:
+                return scope, slots[name]
+            function = function.enclosing
+        return 0, self._name_id(name)
+
+    def visit_program(self, node):
+        block = self.encode(node.block)
+        return self._emit(PROGRAM, block)
+
+    def visit_block(self, node):
+        arrays = []
+        for declaration in node.declarations:
+            declaration.accept(self)
+            type_node = getattr(declaration, 'type_node', None)
+            if isinstance(type_node, ArrayType):
+                arrays.extend(self._variable(declaration.var_node.value))
+                arrays.extend((
+                    0 if type_node.element_type.value == INTEGER else 1,
+                    type_node.length))
+        body = self.encode(node.compound_statement)
+        return self._emit(BLOCK, len(arrays) // 4, *arrays, body)
+
+    def visit_var_decl(self, node):
+        pass
+
+    def visit_func_decl(self, node):
+        '''
+        FUNCTION scope, frame size, result slot, pure, parameter count,
+        (slot, is REAL) of each parameter, body. The body offset is
+        filled in last so that recursive calls can refer to the record.
+        '''
+        if node.local_names is None:
+            raise ValueError('analyse the program before sharing it')
+        slots = {name: slot for slot, name in enumerate(node.local_names)}
+        scope = self.scope_count
+        self.scope_count += 1
+        self._scopes[node] = scope, slots
+        params = []
+        for param in node.params:
+            params.extend((slots[param.var_node.value],
+                int(param.type_node.value == REAL)))
+        offset = self._functions[node] = self._emit(FUNCTION, scope,
+            len(slots), slots[node.func_name], int(bool(node.pure)),
+            len(node.params), *params, 0)
+
+        outer, self._function = self._function, node
+        try:
+            body = self.encode(node.block_node)
+        finally:
+            self._function = outer
+        self.words[offset + 6 + len(params)] = body
+        return offset
+
+    def visit_compound_statement(self, node):
+        children = [self.encode(child) for child in node.children]
+        return self._emit(COMPOUND, len(children), *children)
+
+    def visit_assignment(self, node):
+        right = self.encode(node.right)
+        return self._emit(ASSIGN, *self._variable(node.left.value), right)
+
+    def visit_indexed_assignment(self, node):
+        left = node.left
+        index, right = self.encode(left.index), self.encode(node.right)
+        return self._emit(INDEXED_ASSIGN, *self._element(left), index, right)
+
+    def _element(self, node):
+        if node.lo is None:
+            raise ValueError('analyse the program before sharing it')
+        return self._variable(node.value) + (self._name_id(node.value),
+            node.lo, node.length, int(node.check is not False))
+
+    def visit_while(self, node):
+        condition, body = self.encode(node.condition), self.encode(node.body)
+        return self._emit(WHILE, condition, body)
+
+    def visit_for(self, node):
+        start, end = self.encode(node.start), self.encode(node.end)
+        body = self.encode(node.body)
+        return self._emit(FOR, *self._variable(node.var_node.value),
+            int(node.direction.type == DOWNTO), start, end, body)
+
+    def visit_no_op(self, node):
+        return self._emit(NO_OP)
+
+    def visit_num(self, node):
+        if node.token.type == FLOAT_CONST:
+            bits = _WORD.unpack(_REAL_BITS.pack(node.value))[0]
+            return self._emit(REAL_NUM, bits)
+        return self._emit(INT, node.value)
+
+    def visit_var(self, node):
+        return self._emit(VAR, *self._variable(node.value))
+
+    def visit_indexed_var(self, node):
+        index = self.encode(node.index)
+        return self._emit(INDEXED_VAR, *self._element(node), index)
+
+    def visit_bin_op(self, node):
+        left, right = self.encode(node.left), self.encode(node.right)
+        return self._emit(BIN_OP, _BINARY_OPS.index(node.op.type), left, right)
+
+    def visit_unary_op(self, node):
+        expr = self.encode(node.expr)
+        return self._emit(UNARY_OP, _UNARY_OPS.index(node.op.type), expr)
+
+    def visit_function_call(self, node):
+        if node.function is None:
+            raise ValueError('analyse the program before sharing it')
+        args = [self.encode(arg) for arg in node.args]
+        return self._emit(CALL, self._functions[node.function], len(args),
+            *args)
+
+    def visit_temp_store(self, node):
+        expr = self.encode(node.expr)
+        return self._emit(TEMP_STORE, node.slot, expr)
+
+    def visit_temp_load(self, node):
+        return self._emit(TEMP_LOAD, node.slot)
+
+class SharedProgram(object):
+    '''
+    an analysed program stored in a `multiprocessing.shared_memory`
+    segment. `create` encodes the tree once; other processes `attach` by
+    segment name and `run` the program straight from the shared words,
+    so nothing is copied or rebuilt per process. Only the small table of
+    variable names is decoded on attach.
+    Function calls get a frame per call and pure functions are memoized
+    in the `Environment` of the run, as with `Visitor`. PROCEDURE bodies
+    are never executed, so they are left out.
+    Attach from processes started by `multiprocessing` from the creating
+    process, which share its resource tracker; the creator `unlink`s the
+    segment once every run has finished.
+    '''
+    def __init__(self, shm):
+        self._shm = shm
+        self._code = shm.buf.toreadonly().cast('q')
+        self._reals = shm.buf.toreadonly().cast('d')
+        code = self._code
+        if code[0] != MAGIC or code[1] != VERSION:
+            self.close()
+            raise ValueError('{} does not hold a shared program'.format(
+                shm.name))
+        self._root = code[2]
+        self._global_count = code[3]
+        self._scope_count = code[4]
+        start, size = code[5], code[6]
+        names = bytes(shm.buf[start:start + size]).decode('utf-8')
+        # global slot i holds names[i]; the program name comes last
+        self.names = names.split('\n')
+        self._handlers = [self._program, self._block, self._compound,
+            self._assign, self._indexed_assign, self._while, self._for,
+            self._no_op, self._int, self._real, self._var, self._indexed_var,
+            self._bin_op, self._unary_op, self._temp_store, self._temp_load,
+            self._function, self._call]
+
+    @classmethod
+    def create(cls, tree, name=None):
+        '''
+        encode `tree`, which must have been analysed by
+        `SymbolTableBuilderVisitor`, into a new segment
+        '''
+        encoder = _Encoder()
+        root = encoder.encode(tree)
+        words = encoder.words
+        names = sorted(encoder.names, key=encoder.names.get)
+        names.append(tree.name)
+        names = '\n'.join(names).encode('utf-8')
+        size = 8 * len(words)
+        words[:HEADER_WORDS] = array('q', [MAGIC, VERSION, root,
+            len(encoder.names), encoder.scope_count, size, len(names)])
+
+        shm = shared_memory.SharedMemory(name=name, create=True,
+            size=size + len(names) + (-len(names) % 8))
+        try:
+            shm.buf[:size] = words.tobytes()
+            shm.buf[size:size + len(names)] = names
+            return cls(shm)
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def size(self):
+        return self._shm.size
+
+    def close(self):
+        self._code.release()
+        self._reals.release()
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self, environment=None):
+        '''
+        run the program and return the `Environment` it ran in, with the
+        same scope a `Visitor` would produce; variables already in the
+        environment's scope start with those values
+        '''
+        if environment is None:
+            environment = Environment()
+        scope = environment.scope
+        names = self.names[:self._global_count]
+        globals_ = [scope.get(name, _UNASSIGNED) for name in names]
+        # the frame of the current activation of each scope
+        self._frames = [globals_] + [None] * (self._scope_count - 1)
+        self._temps = environment.temps
+        self._function_cache = environment.function_cache
+        try:
+            self._exec(self._root)
+        finally:
+            self._frames = self._temps = self._function_cache = None
+        scope['PROGRAM'] = self.names[-1]
+        for name, value in zip(names, globals_):
+            if value is not _UNASSIGNED:
+                scope[name] = value
+        return environment
+
+    def _exec(self, offset):
+        return self._handlers[self._code[offset]](offset)
+
+    def _program(self, at):
+        self._exec(self._code[at + 1])
+
+    def _block(self, at):
+        code = self._code
+        count = code[at + 1]
+        for decl in range(at + 2, at + 2 + 4 * count, 4):
+            self._frames[code[decl]][code[decl + 1]] = array(
+                _TYPECODES[code[decl + 2]], bytes(8 * code[decl + 3]))
+        self._exec(code[at + 2 + 4 * count])
+
+    def _function(self, at):
+        # declarations only run when called
+        pass
+
+    def _compound(self, at):
+        code = self._code
+        handlers = self._handlers
+        for child in code[at + 2:at + 2 + code[at + 1]]:
+            handlers[code[child]](child)
+
+    def _assign(self, at):
+        code = self._code
+        value = self._exec(code[at + 3])
+        self._frames[code[at + 1]][code[at + 2]] = value
+
+    def _indexed_assign(self, at):
+        code = self._code
+        offset = self._offset(at)
+        value = self._exec(code[at + 8])
+        self._frames[code[at + 1]][code[at + 2]][offset] = value
+
+    def _offset(self, at):
+        '''the checked buffer offset of the element described at `at`'''
+        code = self._code
+        lo, length = code[at + 4], code[at + 5]
+        offset = self._exec(code[at + 7]) - lo
+        if code[at + 6] and not 0 <= offset < length:
+            raise IndexError('{} index {} out of range [{}..{}]'.format(
+                self.names[code[at + 3]], offset + lo, lo, lo + length - 1))
+        return offset
+
+    def _while(self, at):
+        code = self._code
+        condition, body = code[at + 1], code[at + 2]
+        while self._exec(condition):
+            self._exec(body)
+
+    def _for(self, at):
+        code = self._code
+        slot, downto, body = code[at + 2], code[at + 3], code[at + 6]
+        start = self._exec(code[at + 4])
+        end = self._exec(code[at + 5])
+        values = self._frames[code[at + 1]]
+        run_body = self._handlers[code[body]]
+        if downto:
+            counter = range(start, end - 1, -1)
+        else:
+            counter = range(start, end + 1)
+        for value in counter:
+            values[slot] = value
+            run_body(body)
+
+    def _no_op(self, at):
+        pass
+
+    def _int(self, at):
+        return self._code[at + 1]
+
+    def _real(self, at):
+        return self._reals[at + 1]
+
+    def _var(self, at):
+        code = self._code
+        value = self._frames[code[at + 1]][code[at + 2]]
+        return None if value is _UNASSIGNED else value
+
+    def _indexed_var(self, at):
+        code = self._code
+        offset = self._offset(at)
+        return self._frames[code[at + 1]][code[at + 2]][offset]
+
+    def _bin_op(self, at):
+        code = self._code
+        return _BINARY_FUNCS[code[at + 1]](
+            self._exec(code[at + 2]), self._exec(code[at + 3]))
+
+    def _unary_op(self, at):
+        code = self._code
+        return _UNARY_FUNCS[code[at + 1]](self._exec(code[at + 2]))
+
+    def _temp_store(self, at):
+        code = self._code
+        value = self._temps[code[at + 1]] = self._exec(code[at + 2])
+        return value
+
+    def _temp_load(self, at):
+        return self._temps[self._code[at + 1]]
+
+    def _call(self, at):
+        code = self._code
+        function = code[at + 1]
+        args = tuple(self._exec(arg)
+            for arg in code[at + 3:at + 3 + code[at + 2]])
+        if not code[function + 4]:
+            return self._invoke(function, args)
+
+        key = (function, args)
+        result = self._function_cache.lookup(key)
+        if result is FunctionCache.MISSING:
+            result = self._invoke(function, args)
+            self._function_cache.store(key, result)
+        return result
+
+    def _invoke(self, function, args):
+        '''run the FUNCTION record at `function` in a new frame'''
+        code = self._code
+        scope, params = code[function + 1], code[function + 5]
+        frame = [None] * code[function + 2]
+        for param, value in zip(
+                range(function + 6, function + 6 + 2 * params, 2), args):
+            frame[code[param]] = float(value) if code[param + 1] else value
+
+        frames = self._frames
+        caller = frames[scope], self._temps
+        frames[scope], self._temps = frame, {}
+        try:
+            self._exec(code[function + 6 + 2 * params])
+        finally:
+            frames[scope], self._temps = caller
+        return frame[code[function + 3]]
+
+def _run_attached(name):
+    program = SharedProgram.attach(name)
+    try:
+        return program.run().scope
+    finally:
+        program.close()
+
+def run_in_processes(tree, runs, max_workers=None):
+    '''
+    share `tree` (parsed and analysed) and run it `runs` times on a
+    process pool; workers receive only the segment name. Returns the
+    scope of each run.
+    '''
+    program = SharedProgram.create(tree)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(_run_attached, [program.name] * runs))
+    finally:
+        program.close()
+        program.unlink()
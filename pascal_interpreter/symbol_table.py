@@ -1,5 +1,24 @@
+from .node_types import (ASTNode, ArrayType, CompoundStatement,
+    AssignmentStatement, IndexedAssignmentStatement, WhileStatement,
+    ForStatement, FunctionCall, Var, Num)
 from .visitor import Visitor
 
+def assigned_names(node, names=None):
+    '''collect the names of variables assigned by a statement'''
+    if names is None:
+        names = []
+    if isinstance(node, CompoundStatement):
+        for child in node.children:
+            assigned_names(child, names)
+    elif isinstance(node, (AssignmentStatement, IndexedAssignmentStatement)):
+        names.append(node.left.value)
+    elif isinstance(node, WhileStatement):
+        assigned_names(node.body, names)
+    elif isinstance(node, ForStatement):
+        names.append(node.var_node.value)
+        assigned_names(node.body, names)
+    return names
+
 class Symbol(object):
     def __init__(self, name, type=None):
         self.name = name
@@ -23,10 +42,55 @@ class VarSymbol(Symbol):
 
     __repr__ = __str__
 
+def _function_calls(node):
+    '''yield every `FunctionCall` in a statement or expression'''
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, FunctionCall):
+            yield node
+        for value in vars(node).values():
+            if isinstance(value, ASTNode):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(v for v in value if isinstance(v, ASTNode))
+
+class FunctionSymbol(Symbol):
+    def __init__(self, name, type, decl):
+        super(FunctionSymbol, self).__init__(name, type)
+        self.decl = decl
+
+    def __str__(self):
+        return '<{name}({params}):{type}>'.format(
+            name=self.name,
+            params=', '.join(map(str, self.decl.params)),
+            type=self.type
+        )
+
+    __repr__ = __str__
+
+class ArrayTypeSymbol(Symbol):
+    def __init__(self, lo, hi, element_type):
+        name = 'ARRAY[{}..{}] OF {}'.format(lo, hi, element_type)
+        super(ArrayTypeSymbol, self).__init__(name, element_type)
+        self.lo = lo
+        self.hi = hi
+
+    def __str__(self):
+        return self.name
+
+    __repr__ = __str__
+
 class SymbolTable(object):
-    def __init__(self):
+    '''
+    the symbols of one scope; names not found here are looked up in
+    `enclosing_scope`. Only the outermost scope defines the builtins.
+    '''
+    def __init__(self, enclosing_scope=None):
         self._symbols = {}
-        self._init_builtins()
+        self.enclosing_scope = enclosing_scope
+        if enclosing_scope is None:
+            self._init_builtins()
 
     def _init_builtins(self):
         self.define(BuiltinTypeSymbol('INTEGER'))
@@ -42,18 +106,57 @@ class SymbolTable(object):
         # print('Define: %s' % symbol)
         self._symbols[symbol.name] = symbol
 
-    def lookup(self, name):
+    def lookup(self, name, current_scope_only=False):
         # print('Lookup: %s' % name)
         symbol = self._symbols.get(name)
+        if (symbol is None and not current_scope_only
+                and self.enclosing_scope is not None):
+            return self.enclosing_scope.lookup(name)
         return symbol
 
+    def lookup_function(self, name):
+        '''
+        like `lookup`, but skips the variable that holds a function's
+        result inside its own body so that recursive calls resolve
+        '''
+        symbol = self._symbols.get(name)
+        if isinstance(symbol, FunctionSymbol):
+            return symbol
+        if self.enclosing_scope is not None:
+            return self.enclosing_scope.lookup_function(name)
+        return None
+
+    def snapshot(self):
+        '''return the symbols defined so far, to be passed to `restore`'''
+        return dict(self._symbols)
+
+    def restore(self, symbols):
+        self._symbols = dict(symbols)
+
+    def var_names(self):
+        return [name for name, symbol in self._symbols.items()
+            if isinstance(symbol, VarSymbol)]
+
 class SymbolTableBuilderVisitor(Visitor):
     def __init__(self):
+        super(SymbolTableBuilderVisitor, self).__init__()
         self.symtable = SymbolTable()
+        # name -> (low, high) of enclosing FOR loops with constant bounds
+        self.index_ranges = {}
+        # the FunctionDecl being analysed, if any, with the non-local
+        # names it reads and the functions it calls
+        self.function = None
+        self.nonlocal_reads = set()
+        self.callees = set()
 
     def visit_var_decl(self, node):
-        type_name = node.type_node.value
-        type_symbol = self.symtable.lookup(type_name)
+        if isinstance(node.type_node, ArrayType):
+            element_type = self.symtable.lookup(
+                node.type_node.element_type.value)
+            type_symbol = ArrayTypeSymbol(node.type_node.lo,
+                node.type_node.hi, element_type)
+        else:
+            type_symbol = self.symtable.lookup(node.type_node.value)
         var_name = node.var_node.value
         var_symbol = VarSymbol(var_name, type_symbol)
         self.symtable.define(var_symbol)
@@ -61,18 +164,152 @@ class SymbolTableBuilderVisitor(Visitor):
     def visit_proc_decl(self, node):
         pass
 
+    def visit_func_decl(self, node):
+        '''
+        analyse the function body in its own scope and decide whether it
+        is pure: it must not read or write non-local variables and may only
+        call pure functions (or itself). Functions are declared before
+        they are used, so every other callee has already been analysed.
+        '''
+        return_type = self.symtable.lookup(node.return_type.value)
+        self.symtable.define(FunctionSymbol(node.func_name, return_type, node))
+        node.enclosing = self.function
+        node.writes = set()
+
+        outer = (self.symtable, self.function, self.nonlocal_reads,
+            self.callees, self.index_ranges)
+        self.symtable = SymbolTable(enclosing_scope=self.symtable)
+        self.function = node
+        self.nonlocal_reads = nonlocal_reads = set()
+        self.callees = callees = set()
+        self.index_ranges = {}
+        try:
+            for param in node.params:
+                param.accept(self)
+            self.symtable.define(VarSymbol(node.func_name, return_type))
+            node.block_node.accept(self)
+            node.local_names = self.symtable.var_names()
+        finally:
+            (self.symtable, self.function, self.nonlocal_reads,
+                self.callees, self.index_ranges) = outer
+
+        callees.discard(node)
+        for callee in callees:
+            node.writes.update(name for name in callee.writes
+                if name not in node.local_names)
+        node.pure = (not node.writes and not nonlocal_reads
+            and all(callee.pure for callee in callees))
+
+    def visit_function_call(self, node):
+        symbol = self.symtable.lookup_function(node.value)
+        if symbol is None:
+            raise NameError(str(node.value))
+        function = symbol.decl
+        if len(node.args) != len(function.params):
+            raise TypeError('{} expects {} argument(s), got {}'.format(
+                node.value, len(function.params), len(node.args)))
+        for arg in node.args:
+            arg.accept(self)
+        node.function = function
+        self.callees.add(function)
+
     def visit_assignment(self, node):
-        var_name = node.left.value
-        var_symbol = self.symtable.lookup(var_name)
-        if var_symbol is None:
-            raise NameError(str(var_name))
+        self._lookup_scalar(node.left.value, write=True)
         return node.right.accept(self)
 
-    def visit_var(self, node):
-        var_name = node.value
+    def visit_indexed_assignment(self, node):
+        self._visit_indexed_var(node.left, write=True)
+        return node.right.accept(self)
+
+    def visit_while(self, node):
+        node.condition.accept(self)
+        node.body.accept(self)
+
+    def visit_for(self, node):
+        var_name = node.var_node.value
+        self._lookup_scalar(var_name, write=True)
+        node.start.accept(self)
+        node.end.accept(self)
+
+        previous = self.index_ranges.pop(var_name, None)
+        bounds = [node.start, node.end]
+        if (all(isinstance(bound, Num) for bound in bounds)
+                and var_name not in assigned_names(node.body)
+                and not self._calls_may_write(node.body, var_name)):
+            values = [bound.value for bound in bounds]
+            self.index_ranges[var_name] = (min(values), max(values))
+        node.body.accept(self)
+        self.index_ranges.pop(var_name, None)
+        if previous is not None:
+            self.index_ranges[var_name] = previous
+
+    def _calls_may_write(self, node, var_name):
+        for call in _function_calls(node):
+            symbol = self.symtable.lookup_function(call.value)
+            if symbol is None:
+                continue
+            function = symbol.decl
+            # the writes of a function still being analysed are unknown
+            if function.pure is None:
+                return True
+            if var_name in function.writes:
+                return True
+        return False
+
+    def _lookup_var(self, var_name, write=False):
         var_symbol = self.symtable.lookup(var_name)
         if var_symbol is None:
             raise NameError(str(var_name))
+        if isinstance(var_symbol, FunctionSymbol):
+            raise TypeError('{} is a function and must be called'.format(
+                var_name))
+        if (self.function is not None and
+                self.symtable.lookup(var_name, current_scope_only=True) is None):
+            if write:
+                self.function.writes.add(var_name)
+            else:
+                self.nonlocal_reads.add(var_name)
+        return var_symbol
+
+    def _lookup_scalar(self, var_name, write=False):
+        var_symbol = self._lookup_var(var_name, write)
+        if isinstance(var_symbol.type, ArrayTypeSymbol):
+            raise TypeError('{} is an array and must be indexed'.format(
+                var_name))
+        return var_symbol
+
+    def visit_var(self, node):
+        self._lookup_scalar(node.value)
+
+    def visit_indexed_var(self, node):
+        self._visit_indexed_var(node, write=False)
+
+    def _visit_indexed_var(self, node, write):
+        var_symbol = self._lookup_var(node.value, write)
+        array_type = var_symbol.type
+        if not isinstance(array_type, ArrayTypeSymbol):
+            raise TypeError('{} is not an array'.format(node.value))
+        node.index.accept(self)
+
+        node.lo = array_type.lo
+        node.length = array_type.hi - array_type.lo + 1
+        node.check = not self._index_in_range(node.index, array_type)
+
+    def _index_in_range(self, index, array_type):
+        '''
+        whether `index` provably lies within the array bounds: a constant,
+        or the variable of an enclosing FOR loop with constant bounds
+        that its body never assigns
+        '''
+        if isinstance(index, Num):
+            if not array_type.lo <= index.value <= array_type.hi:
+                raise IndexError('index {} out of range [{}..{}]'.format(
+                    index.value, array_type.lo, array_type.hi))
+            return True
+        if isinstance(index, Var) and index.value in self.index_ranges:
+            low, high = self.index_ranges[index.value]
+            return array_type.lo <= low and high <= array_type.hi
+        return False
 
     # TODO these methods should be implemented by the parent class
     def visit_bin_op(self, node):
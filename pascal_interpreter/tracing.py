@@ -0,0 +1,157 @@
+import json
+import struct
+
+MAGIC = b'PTRC'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIQI')
+
+INT_KIND, REAL_KIND, OTHER_KIND = 0, 1, 2
+_INT_RECORD = struct.Struct('<IIBq')
+_REAL_RECORD = struct.Struct('<IIBd')
+RECORD_SIZE = _INT_RECORD.size
+
+class TraceBuffer(object):
+    '''
+    fixed-size ring buffer of executed assignments, and of the writes of
+    FOR loops to their counters if `counters` is true (they are off by
+    default, as they add a record to every iteration of every counted
+    loop). Each record holds the assignment's node id, the slot of the
+    assigned variable and its new value (a 64-bit integer or double;
+    values that fit neither are recorded as `OTHER_KIND`). Once
+    `capacity` records have been written the oldest are overwritten.
+    Records are kept in two machine-word columns, halves of a single
+    allocation, so that recording is a
+    pair of stores: a key packing the node id, slot and kind, and the
+    value, written as an integer or a double. `records` and `dump`
+    convert them to the `RECORD_SIZE`-byte file format. Node ids and
+    slots are numbered in order of first use; `dump` saves their
+    descriptions along with the records.
+    '''
+    def __init__(self, capacity=65536, counters=False):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1, got {}'.format(
+                capacity))
+        self.capacity = capacity
+        self.counters = counters
+        self.count = 0
+        columns = memoryview(bytearray(16 * capacity))
+        self._keys = columns[:8 * capacity].cast('Q')
+        self._ints = columns[8 * capacity:].cast('q')
+        self._reals = columns[8 * capacity:].cast('d')
+        # a node always assigns the same variable, so one lookup gives
+        # the key of its records
+        self._node_keys = {}
+        self._nodes = []
+        self._slots = {}
+
+    def _register(self, node, name):
+        slot = self._slots.get(name)
+        if slot is None:
+            slot = self._slots[name] = len(self._slots)
+        key = self._node_keys[node] = len(self._nodes) << 32 | slot << 2
+        self._nodes.append(node)
+        return key
+
+    def record(self, node, name, value):
+        key = self._node_keys.get(node)
+        if key is None:
+            key = self._register(node, name)
+        count = self.count
+        self.count = count + 1
+        index = count % self.capacity
+        if type(value) is float:
+            self._reals[index] = value
+            self._keys[index] = key | REAL_KIND
+        else:
+            try:
+                self._ints[index] = value
+            except (ValueError, TypeError):
+                key |= OTHER_KIND
+            self._keys[index] = key
+
+    def _raw_records(self):
+        '''the stored records in the file format, oldest first'''
+        if self.count <= self.capacity:
+            indices = range(self.count)
+        else:
+            split = self.count % self.capacity
+            indices = list(range(split, self.capacity)) + list(range(split))
+        data = bytearray(len(indices) * RECORD_SIZE)
+        for offset, index in zip(range(0, len(data), RECORD_SIZE), indices):
+            key = self._keys[index]
+            node_id, slot, kind = key >> 32, (key >> 2) & 0x3fffffff, key & 3
+            if kind == REAL_KIND:
+                _REAL_RECORD.pack_into(data, offset, node_id, slot, kind,
+                    self._reals[index])
+            else:
+                _INT_RECORD.pack_into(data, offset, node_id, slot, kind,
+                    self._ints[index] if kind == INT_KIND else 0)
+        return bytes(data)
+
+    def records(self):
+        '''return the stored records as (node id, slot, value) tuples'''
+        return list(_decode(self._raw_records()))
+
+    def dump(self, path):
+        metadata = json.dumps({
+            'nodes': [str(node) for node in self._nodes],
+            'slots': sorted(self._slots, key=self._slots.get),
+        }).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, self.capacity,
+                self.count, len(metadata)))
+            f.write(metadata)
+            f.write(self._raw_records())
+
+def _decode(data):
+    for offset in range(0, len(data), RECORD_SIZE):
+        node_id, slot, kind, value = _INT_RECORD.unpack_from(data, offset)
+        if kind == REAL_KIND:
+            value = _REAL_RECORD.unpack_from(data, offset)[3]
+        elif kind == OTHER_KIND:
+            value = None
+        yield node_id, slot, value
+
+def load(path):
+    '''
+    read a file written by `TraceBuffer.dump` and return a dict with the
+    total number of records written, the node and slot descriptions and
+    the (node id, slot, value) records that were still in the buffer
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, record_size, capacity, count, metadata_size = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+        raise ValueError('{} is not a version {} trace file'.format(
+            path, VERSION))
+    start = HEADER.size
+    metadata = json.loads(data[start:start + metadata_size].decode('utf-8'))
+    return {
+        'capacity': capacity,
+        'count': count,
+        'nodes': metadata['nodes'],
+        'slots': metadata['slots'],
+        'records': list(_decode(data[start + metadata_size:])),
+    }
+
+def main():
+    '''
+    print a dumped trace:
+        python -m pascal_interpreter.tracing trace.bin
+    '''
+    import sys
+    if len(sys.argv) != 2:
+        print('usage: python -m pascal_interpreter.tracing <trace file>')
+        sys.exit(1)
+    trace = load(sys.argv[1])
+    records = trace['records']
+    first = trace['count'] - len(records)
+    print('{} assignments traced, last {} kept'.format(
+        trace['count'], len(records)))
+    for seq, (node_id, slot, value) in enumerate(records, first):
+        print('{:>8} {:<10} = {!s:<20} {}'.format(seq, trace['slots'][slot],
+            value, trace['nodes'][node_id]))
+
+if __name__ == '__main__':
+    main()
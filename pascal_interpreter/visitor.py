@@ -1,4 +1,12 @@
-from .keywords import PLUS, MINUS, MUL, FLOAT_DIV, INTEGER_DIV
+from array import array
+from types import GeneratorType
+
+from .environment import Environment, Frame, FunctionCache
+from .keywords import (PLUS, MINUS, MUL, FLOAT_DIV, INTEGER_DIV, DOWNTO,
+    EQUAL, NOT_EQUAL, LESS_THAN, LESS_EQUAL, GREATER_THAN, GREATER_EQUAL,
+    INTEGER, REAL)
+from .node_types import (ArrayType, BinOp, UnaryOp, IndexedVar, FunctionCall,
+    TempStore)
 
 def calculate_values(func):
     def wrapper_calc(obj, node, left, right):
@@ -13,6 +21,18 @@ def calculate_values(func):
             return left / right
         elif node.op.type == INTEGER_DIV:
             return left // right
+        elif node.op.type == EQUAL:
+            return left == right
+        elif node.op.type == NOT_EQUAL:
+            return left != right
+        elif node.op.type == LESS_THAN:
+            return left < right
+        elif node.op.type == LESS_EQUAL:
+            return left <= right
+        elif node.op.type == GREATER_THAN:
+            return left > right
+        elif node.op.type == GREATER_EQUAL:
+            return left >= right
         else:
             raise Exception('Invalid op type')
     return wrapper_calc
@@ -22,16 +42,33 @@ class Visitor(object):
     base class for Visitors - defines methods for non-terminals in tree
     Visitors may define their own calculate method for side effects, but
     it must use the `caculate_values` decorator to ensure that names in
-    `GLOBAL_SCOPE` have non-`None` values
+    `scope` have non-`None` values
     -- OR --
     child class may implement `visit_bin_op` and `visit_unary_op` such
     that no arithmetic is performed on `None` values
     TODO separate base class from a child class to perform calculations
     '''
-    GLOBAL_SCOPE = {}
+    def __init__(self, environment=None):
+        self.bind(environment if environment is not None else Environment())
+        # optional `TraceBuffer` that records every executed assignment
+        self.trace = None
+
+    def bind(self, environment):
+        '''
+        run against `environment`; its scope and temporaries are cached
+        as attributes since they are used by every variable access
+        '''
+        self.environment = environment
+        self.scope = environment.scope
+        # optimizer temporaries live outside `scope` so that they never
+        # show up in the reported scope
+        self.temps = environment.temps
+        # FunctionDecl -> frame of its most recent activation, used to find
+        # the enclosing frame of nested functions
+        self.activations = {}
 
     def visit_program(self, node):
-        self.GLOBAL_SCOPE['PROGRAM'] = node.name
+        self.scope['PROGRAM'] = node.name
         return node.block.accept(self)
 
     def visit_block(self, node):
@@ -40,11 +77,20 @@ class Visitor(object):
         return node.compound_statement.accept(self)
 
     def visit_var_decl(self, node):
-        pass
+        type_node = node.type_node
+        if isinstance(type_node, ArrayType):
+            # zero-filled machine integers/doubles rather than a list of
+            # boxed Python numbers
+            typecode = 'q' if type_node.element_type.value == INTEGER else 'd'
+            self.scope[node.var_node.value] = array(
+                typecode, bytes(8 * type_node.length))
 
     def visit_proc_decl(self, node):
         pass
 
+    def visit_func_decl(self, node):
+        pass
+
     def visit_type(self, node):
         pass
 
@@ -54,14 +100,125 @@ class Visitor(object):
 
     def visit_assignment(self, node):
         var_name = node.left.value
-        self.GLOBAL_SCOPE[var_name] = node.right.accept(self)
-        return self.GLOBAL_SCOPE[var_name]
+        value = self.scope[var_name] = node.right.accept(self)
+        trace = self.trace
+        if trace is not None:
+            trace.record(node, var_name, value)
+        return value
+
+    def visit_indexed_assignment(self, node):
+        offset = self._offset(node.left)
+        value = node.right.accept(self)
+        array = self.scope[node.left.value]
+        array[offset] = value
+        if self.trace is not None:
+            self.trace.record(node, node.left.value, array[offset])
+        return value
+
+    def visit_while(self, node):
+        while node.condition.accept(self):
+            node.body.accept(self)
+
+    def visit_for(self, node):
+        '''
+        counted loop fast path: the bounds are evaluated once and the
+        iteration is driven by `range`, so only the body is dispatched
+        on each pass. As in Pascal, assigning to the loop variable in the
+        body does not change the number of iterations.
+        '''
+        var_name = node.var_node.value
+        scope = self.scope
+        trace = self.trace
+        if trace is not None and not trace.counters:
+            trace = None
+        run_body = node.body.accept
+        for value in self._for_range(
+                node, node.start.accept(self), node.end.accept(self)):
+            scope[var_name] = value
+            if trace is not None:
+                trace.record(node, var_name, value)
+            run_body(self)
+
+    def _for_range(self, node, start, end):
+        if node.direction.type == DOWNTO:
+            return range(start, end - 1, -1)
+        return range(start, end + 1)
 
     def visit_var(self, node):
         var_name = node.value
-        val = self.GLOBAL_SCOPE.get(var_name)
+        val = self.scope.get(var_name)
         return val
 
+    def visit_indexed_var(self, node):
+        return self.scope[node.value][self._offset(node)]
+
+    def _offset(self, node, index=None):
+        '''
+        return the buffer offset of an array element, evaluating its index
+        unless the value is given; the bounds check is skipped when
+        analysis proved the index is always in range
+        '''
+        if index is None:
+            index = node.index.accept(self)
+        offset = index - node.lo
+        if node.check is not False and not 0 <= offset < node.length:
+            raise IndexError('{} index {} out of range [{}..{}]'.format(
+                node.value, offset + node.lo, node.lo,
+                node.lo + node.length - 1))
+        return offset
+
+    def visit_function_call(self, node):
+        function = node.function
+        args = tuple(arg.accept(self) for arg in node.args)
+        if not function.pure:
+            return self._call(function, args)
+
+        cache = self.environment.function_cache
+        key = (function, args)
+        result = cache.lookup(key)
+        if result is FunctionCache.MISSING:
+            result = self._call(function, args)
+            cache.store(key, result)
+        return result
+
+    def _call(self, function, args):
+        frame, caller = self._enter(function, args)
+        try:
+            self._run_body(function.block_node)
+        finally:
+            self._leave(function, caller)
+        return frame[function.func_name]
+
+    def _enter(self, function, args):
+        '''
+        make a frame holding the arguments of a call to `function` the
+        current scope; returns it with the state `_leave` restores
+        '''
+        if function.enclosing is None:
+            parent = self.environment.scope
+        else:
+            parent = self.activations[function.enclosing]
+        frame = Frame(parent, function.local_names)
+        for param, value in zip(function.params, args):
+            if param.type_node.value == REAL:
+                value = float(value)
+            frame[param.var_node.value] = value
+
+        caller = self.scope, self.temps, self.activations.get(function)
+        self.scope, self.temps = frame, {}
+        self.activations[function] = frame
+        return frame, caller
+
+    def _leave(self, function, caller):
+        self.scope, self.temps, previous = caller
+        if previous is None:
+            del self.activations[function]
+        else:
+            self.activations[function] = previous
+
+    def _run_body(self, block):
+        block.accept(self)
+
     def visit_no_op(self, node):
         pass
 
@@ -82,10 +239,169 @@ class Visitor(object):
     def visit_num(self, node):
         return node.value
 
+    def visit_temp_store(self, node):
+        value = node.expr.accept(self)
+        self.temps[node.slot] = value
+        return value
+
+    def visit_temp_load(self, node):
+        return self.temps[node.slot]
+
     @calculate_values
     def calculate(self, node, left, right):
         pass
 
+def _contains_call(node):
+    '''whether evaluating the expression `node` calls a function'''
+    if isinstance(node, FunctionCall):
+        return True
+    if isinstance(node, BinOp):
+        return _contains_call(node.left) or _contains_call(node.right)
+    if isinstance(node, (UnaryOp, TempStore)):
+        return _contains_call(node.expr)
+    if isinstance(node, IndexedVar):
+        return _contains_call(node.index)
+    return False
+
+class SteppingVisitor(Visitor):
+    '''
+    executes a program one statement at a time: visiting the program
+    returns a generator that yields after every simple statement
+    (assignment or empty statement) and every loop iteration, so the
+    caller decides when execution continues. The statements of a called
+    function are steps too: expressions that contain calls are evaluated
+    by generators, while other expressions are still evaluated in one go.
+    '''
+    def __init__(self, environment=None):
+        super(SteppingVisitor, self).__init__(environment)
+        # expression -> whether it contains a function call
+        self._calls = {}
+
+    def _has_calls(self, node):
+        has_calls = self._calls.get(node)
+        if has_calls is None:
+            has_calls = self._calls[node] = _contains_call(node)
+        return has_calls
+
+    def _steps(self, node):
+        steps = node.accept(self)
+        if isinstance(steps, GeneratorType):
+            yield from steps
+        else:
+            yield
+
+    def _evaluate(self, node):
+        '''
+        generator that yields the steps of the function calls in the
+        expression `node` and returns its value
+        '''
+        if not self._has_calls(node):
+            return node.accept(self)
+        if isinstance(node, FunctionCall):
+            return (yield from self._call_function(node))
+        if isinstance(node, BinOp):
+            left = yield from self._evaluate(node.left)
+            right = yield from self._evaluate(node.right)
+            return self.calculate(node, left, right)
+        if isinstance(node, UnaryOp):
+            value = yield from self._evaluate(node.expr)
+            return +value if node.op.type == PLUS else -value
+        if isinstance(node, IndexedVar):
+            index = yield from self._evaluate(node.index)
+            return self.scope[node.value][self._offset(node, index)]
+        # TempStore
+        value = self.temps[node.slot] = yield from self._evaluate(node.expr)
+        return value
+
+    def _call_function(self, node):
+        function = node.function
+        args = []
+        for arg in node.args:
+            args.append((yield from self._evaluate(arg)))
+        args = tuple(args)
+        if not function.pure:
+            return (yield from self._call_steps(function, args))
+
+        cache = self.environment.function_cache
+        key = (function, args)
+        result = cache.lookup(key)
+        if result is FunctionCache.MISSING:
+            result = yield from self._call_steps(function, args)
+            cache.store(key, result)
+        return result
+
+    def _call_steps(self, function, args):
+        frame, caller = self._enter(function, args)
+        try:
+            yield from self._steps(function.block_node)
+        finally:
+            self._leave(function, caller)
+        return frame[function.func_name]
+
+    def _run_body(self, block):
+        # calls are normally made by `_call_function`; a call evaluated
+        # in one go runs its body to completion
+        for _ in block.accept(self):
+            pass
+
+    def visit_block(self, node):
+        for declaration in node.declarations:
+            declaration.accept(self)
+        return self._steps(node.compound_statement)
+
+    def visit_compound_statement(self, node):
+        for child in node.children:
+            yield from self._steps(child)
+
+    def visit_assignment(self, node):
+        if not self._has_calls(node.right):
+            return super(SteppingVisitor, self).visit_assignment(node)
+        return self._assignment_steps(node)
+
+    def _assignment_steps(self, node):
+        var_name = node.left.value
+        value = yield from self._evaluate(node.right)
+        self.scope[var_name] = value
+        if self.trace is not None:
+            self.trace.record(node, var_name, value)
+
+    def visit_indexed_assignment(self, node):
+        if not (self._has_calls(node.left) or self._has_calls(node.right)):
+            return super(SteppingVisitor, self).visit_indexed_assignment(node)
+        return self._indexed_assignment_steps(node)
+
+    def _indexed_assignment_steps(self, node):
+        index = yield from self._evaluate(node.left.index)
+        offset = self._offset(node.left, index)
+        value = yield from self._evaluate(node.right)
+        array = self.scope[node.left.value]
+        array[offset] = value
+        if self.trace is not None:
+            self.trace.record(node, node.left.value, array[offset])
+
+    def visit_while(self, node):
+        condition = node.condition
+        if not self._has_calls(condition):
+            while condition.accept(self):
+                yield from self._steps(node.body)
+        else:
+            while (yield from self._evaluate(condition)):
+                yield from self._steps(node.body)
+
+    def visit_for(self, node):
+        var_name = node.var_node.value
+        start = yield from self._evaluate(node.start)
+        end = yield from self._evaluate(node.end)
+        scope = self.scope
+        trace = self.trace
+        if trace is not None and not trace.counters:
+            trace = None
+        for value in self._for_range(node, start, end):
+            scope[var_name] = value
+            if trace is not None:
+                trace.record(node, var_name, value)
+            yield from self._steps(node.body)
+
 class PostfixNotationVisitor(Visitor):
     @calculate_values
     def calculate(self, node, left, right):
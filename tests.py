@@ -1,8 +1,33 @@
+import asyncio
+import os
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
-from pascal_interpreter.lexer import Lexer
+from pascal_interpreter.lexer import Lexer, TokenStream
 from pascal_interpreter.parser import Parser
+from pascal_interpreter.environment import Environment
+from pascal_interpreter.execution import (PreparedProgram, execute,
+    execute_concurrently, execute_async)
 from pascal_interpreter.keywords import Token
+from pascal_interpreter.interpreter import Interpreter
+from pascal_interpreter.node_factory import InterningNodeFactory
+from pascal_interpreter.optimizer import Optimizer
+from pascal_interpreter.parallel_lexer import (find_split_points, tokenize,
+    parallel_tokenize)
+from pascal_interpreter.session import Session
+from pascal_interpreter.shared_program import SharedProgram, run_in_processes
+from pascal_interpreter.symbol_table import SymbolTableBuilderVisitor
+from pascal_interpreter.tracing import TraceBuffer, load
+from pascal_interpreter.visitor import Visitor
+
+def run_program(text, factory=None):
+    '''analyse and execute `text`, returning the resulting scope'''
+    interpreter = Interpreter(Parser(Lexer(text), factory).parse())
+    interpreter.interpret(SymbolTableBuilderVisitor())
+    visitor = Visitor()
+    interpreter.interpret(visitor)
+    return visitor.scope
 
 class TestLexer(unittest.TestCase):
 
@@ -82,6 +107,55 @@ class TestLexer(unittest.TestCase):
         token = self.lexer.get_next_token()
         self.assertEqual(token, Token('EOF', None))
 
+    def test_comparison_operators(self):
+        self.lexer = Lexer('a<>b <= c >= d < e > f = g')
+        types = []
+        token = self.lexer.get_next_token()
+        while token.type != 'EOF':
+            types.append(token.type)
+            token = self.lexer.get_next_token()
+        self.assertEqual(types, ['ID', 'NOT_EQUAL', 'ID', 'LESS_EQUAL', 'ID',
+            'GREATER_EQUAL', 'ID', 'LESS_THAN', 'ID', 'GREATER_THAN', 'ID',
+            'EQUAL', 'ID'])
+
+    def test_keyword_prefix_is_identifier(self):
+        self.lexer = Lexer('dog')
+        self.assertEqual(self.lexer.get_next_token(), Token('ID', 'DOG'))
+
+    def test_iter(self):
+        self.assertEqual(list(Lexer('a := 2')), [
+            Token('ID', 'A'), Token('ASSIGN', ':='), Token('INTEGER_CONST', 2)])
+
+class TestParallelLexer(unittest.TestCase):
+
+    TEXT = """
+        PROGRAM Chunks;
+        VAR a, b : INTEGER;
+        BEGIN
+            a := 1; { a; comment; with; semicolons }
+            b := a + 2.5;{;}a := b DIV 2;
+            WHILE a < 10 DO a := a + 1
+        END.
+    """
+
+    def test_split_points_skip_comments(self):
+        points = find_split_points(self.TEXT, 40)
+        self.assertEqual(points, sorted(set(points)))
+        for point in points:
+            self.assertEqual(self.TEXT[point - 1], ';')
+            before = self.TEXT[:point]
+            self.assertGreaterEqual(before.count('}'), before.count('{'))
+
+    def test_matches_sequential_lexer(self):
+        expected = tokenize(self.TEXT)
+        tokens = parallel_tokenize(self.TEXT, workers=2, chunks=8,
+            min_chunk_size=1)
+        self.assertEqual(tokens, expected)
+
+    def test_token_stream_feeds_parser(self):
+        tree = Parser(TokenStream(tokenize(self.TEXT))).parse()
+        self.assertEqual(tree.name, 'CHUNKS')
+
 class TestParser(unittest.TestCase):
 
     def setUp(self):
@@ -108,6 +182,770 @@ class TestParser(unittest.TestCase):
         tree = self.parser.parse()
         self.assertEqual(tree.name, 'TESTVARS')
 
+    def test_lazy_procedures(self):
+        with open('part12.pas', 'r') as f:
+            text = f.read()
+        eager = Parser(Lexer(text)).parse()
+        lazy = Parser(Lexer(text), lazy_procedures=True).parse()
+        proc = lazy.block.declarations[1]
+        self.assertFalse(proc.is_parsed)
+        self.assertEqual(str(lazy.block.compound_statement),
+            str(eager.block.compound_statement))
+        nested = proc.block_node.declarations[2]
+        self.assertTrue(proc.is_parsed)
+        self.assertFalse(nested.is_parsed)
+        self.assertEqual(str(proc.block_node),
+            str(eager.block.declarations[1].block_node))
+
+    def test_lazy_procedure_syntax_error_is_deferred(self):
+        tree = Parser(Lexer("""
+            PROGRAM Lazy;
+            PROCEDURE Broken; BEGIN BEGIN := 1 END END;
+            BEGIN END.
+        """), lazy_procedures=True).parse()
+        with self.assertRaises(Exception):
+            tree.block.declarations[0].block_node
+
+class TestInterningNodeFactory(unittest.TestCase):
+
+    def test_identical_subtrees_are_shared(self):
+        factory = InterningNodeFactory()
+        tree = Parser(Lexer("""
+            PROGRAM Share;
+            VAR a, b : INTEGER;
+            BEGIN a := (b + 1) * 2; b := (b + 1) * 3 END.
+        """), factory).parse()
+        first, second = tree.block.compound_statement.children
+        self.assertIs(first.right.left, second.right.left)
+        self.assertIs(first.right.left.left, second.left)
+        self.assertIsNot(first.right, second.right)
+
+    def test_same_result_as_plain_nodes(self):
+        with open('test_vars.pas', 'r') as f:
+            text = f.read().replace('x := 11;', '')
+        self.assertEqual(run_program(text, InterningNodeFactory()),
+            run_program(text))
+
+class TestLoops(unittest.TestCase):
+
+    def test_while(self):
+        scope = run_program("""
+            PROGRAM W;
+            VAR f, n : INTEGER;
+            BEGIN
+                f := 1; n := 5;
+                WHILE n > 1 DO BEGIN f := f * n; n := n - 1 END
+            END.
+        """)
+        self.assertEqual(scope['F'], 120)
+        self.assertEqual(scope['N'], 1)
+
+    def test_parenthesized_condition(self):
+        scope = run_program("""
+            PROGRAM W;
+            VAR n, c : INTEGER;
+            BEGIN
+                n := 3; c := 0;
+                WHILE (n > 0) DO BEGIN n := n - 1; c := c + 1 END
+            END.
+        """)
+        self.assertEqual(scope['N'], 0)
+        self.assertEqual(scope['C'], 3)
+
+    def test_for(self):
+        scope = run_program("""
+            PROGRAM F;
+            VAR i, s, d, e : INTEGER;
+            BEGIN
+                s := 0; d := 0; e := 0;
+                FOR i := 1 TO 10 DO s := s + i;
+                FOR i := 3 DOWNTO 1 DO d := d * 10 + i;
+                FOR i := 2 TO 1 DO e := 1
+            END.
+        """)
+        self.assertEqual(scope['S'], 55)
+        self.assertEqual(scope['D'], 321)
+        self.assertEqual(scope['E'], 0)
+
+    def test_for_bounds_evaluated_once(self):
+        scope = run_program("""
+            PROGRAM F;
+            VAR i, n, count : INTEGER;
+            BEGIN
+                n := 3; count := 0;
+                FOR i := 1 TO n DO BEGIN n := n + 1; count := count + 1 END
+            END.
+        """)
+        self.assertEqual(scope['COUNT'], 3)
+
+    def test_undeclared_loop_variable(self):
+        with self.assertRaises(NameError):
+            run_program('PROGRAM F; BEGIN FOR i := 1 TO 2 DO END.')
+
+class TestArrays(unittest.TestCase):
+
+    def test_typed_buffers(self):
+        scope = run_program("""
+            PROGRAM Arr;
+            VAR a : ARRAY [1..5] OF INTEGER;
+                r : ARRAY [-2..2] OF REAL;
+                i, s : INTEGER;
+            BEGIN
+                FOR i := 1 TO 5 DO a[i] := i * i;
+                s := 0;
+                FOR i := 5 DOWNTO 1 DO s := s + a[i];
+                r[-2] := 1.5; r[2] := r[-2] * 2
+            END.
+        """)
+        self.assertEqual(scope['A'].typecode, 'q')
+        self.assertEqual(list(scope['A']), [1, 4, 9, 16, 25])
+        self.assertEqual(scope['R'].typecode, 'd')
+        self.assertEqual(list(scope['R']), [1.5, 0.0, 0.0, 0.0, 3.0])
+        self.assertEqual(scope['S'], 55)
+
+    def test_bounds_checked_at_runtime(self):
+        with self.assertRaises(IndexError):
+            run_program("""
+                PROGRAM Arr;
+                VAR a : ARRAY [1..3] OF INTEGER; i : INTEGER;
+                BEGIN i := 0; a[i] := 1 END.
+            """)
+
+    def test_constant_index_out_of_range(self):
+        with self.assertRaises(IndexError):
+            run_program("""
+                PROGRAM Arr;
+                VAR a : ARRAY [1..3] OF INTEGER;
+                BEGIN a[4] := 1 END.
+            """)
+
+    def test_bounds_check_hoisting(self):
+        tree = Parser(Lexer("""
+            PROGRAM Arr;
+            VAR a : ARRAY [1..3] OF INTEGER; i, n : INTEGER;
+            BEGIN
+                FOR i := 1 TO 3 DO a[i] := 1;
+                FOR i := 1 TO 4 DO n := 1;
+                FOR i := 0 TO 2 DO a[i + 1] := 2;
+                FOR i := 1 TO 3 DO BEGIN i := 1; a[i] := 3 END
+            END.
+        """)).parse()
+        Interpreter(tree).interpret(SymbolTableBuilderVisitor())
+        loops = tree.block.compound_statement.children
+        self.assertIs(loops[0].body.left.check, False)
+        self.assertIs(loops[2].body.left.check, True)
+        self.assertIs(loops[3].body.children[1].left.check, True)
+
+    def test_type_errors(self):
+        with self.assertRaises(TypeError):
+            run_program("""
+                PROGRAM Arr; VAR a : ARRAY [1..3] OF INTEGER;
+                BEGIN a := 1 END.
+            """)
+        with self.assertRaises(TypeError):
+            run_program("""
+                PROGRAM Arr; VAR a : INTEGER;
+                BEGIN a[1] := 1 END.
+            """)
+
+class TestFunctions(unittest.TestCase):
+
+    SOURCE = """
+        PROGRAM Fn;
+        VAR r, g, k : INTEGER;
+            x : REAL;
+
+        FUNCTION Fib(n : INTEGER) : INTEGER;
+        BEGIN
+            Fib := n;
+            WHILE n > 1 DO BEGIN
+                Fib := Fib(n - 1) + Fib(n - 2);
+                n := 0
+            END
+        END;
+
+        FUNCTION Bump(d : INTEGER) : INTEGER;
+            FUNCTION Twice(v : INTEGER) : INTEGER;
+            BEGIN Twice := v * 2 END;
+        BEGIN
+            g := g + Twice(d);
+            Bump := g
+        END;
+
+        FUNCTION Scaled(a : REAL; c : INTEGER) : REAL;
+        BEGIN Scaled := a * c + g END;
+
+        BEGIN
+            g := 0;
+            r := Fib(25);
+            k := Bump(1) + Bump(1);
+            x := Scaled(1, 2)
+        END.
+    """
+
+    def run_source(self, cache_capacity=1024):
+        tree = Parser(Lexer(self.SOURCE)).parse()
+        interpreter = Interpreter(tree)
+        interpreter.interpret(SymbolTableBuilderVisitor())
+        environment = Environment(cache_capacity=cache_capacity)
+        interpreter.interpret(Visitor(), environment)
+        return tree, environment
+
+    def test_results(self):
+        _, environment = self.run_source()
+        self.assertEqual(environment.scope, {'PROGRAM': 'FN', 'R': 75025,
+            'G': 4, 'K': 6, 'X': 6.0})
+
+    def test_purity(self):
+        tree, _ = self.run_source()
+        fib, bump, scaled = tree.block.declarations[4:]
+        twice = bump.block_node.declarations[0]
+        self.assertTrue(fib.pure)
+        self.assertTrue(twice.pure)
+        self.assertFalse(bump.pure)
+        self.assertEqual(bump.writes, {'G'})
+        self.assertFalse(scaled.pure)
+
+    def test_memoization(self):
+        _, environment = self.run_source()
+        cache = environment.function_cache
+        # each Fib(n) is computed once; Twice(1) is cached on its second call
+        self.assertEqual(cache.misses, 27)
+        self.assertEqual(cache.hits, 24)
+        self.assertAlmostEqual(cache.hit_rate, 24 / 51)
+
+    def test_cache_is_bounded(self):
+        _, environment = self.run_source(cache_capacity=2)
+        self.assertEqual(len(environment.function_cache), 2)
+        self.assertEqual(environment.scope['R'], 75025)
+
+    def test_wrong_argument_count(self):
+        with self.assertRaises(TypeError):
+            run_program("""
+                PROGRAM Fn; VAR r : INTEGER;
+                FUNCTION F(a : INTEGER) : INTEGER; BEGIN F := a END;
+                BEGIN r := F(1, 2) END.
+            """)
+
+    def test_lazy_skips_nested_functions(self):
+        tree = Parser(Lexer("""
+            PROGRAM Lazy;
+            PROCEDURE P;
+                FUNCTION F(a, b : INTEGER; c : REAL) : INTEGER;
+                BEGIN F := a END;
+            BEGIN END;
+            BEGIN END.
+        """), lazy_procedures=True).parse()
+        body = tree.block.declarations[0].block_node
+        self.assertEqual(body.declarations[0].func_name, 'F')
+
+class TestTracing(unittest.TestCase):
+
+    SOURCE = """
+        PROGRAM Traced;
+        VAR i, s : INTEGER; x : REAL; a : ARRAY [1..2] OF INTEGER;
+        BEGIN
+            x := 0.5;
+            FOR i := 1 TO 2 DO BEGIN s := i * 10; a[i] := s END
+        END.
+    """
+
+    def run_traced(self, capacity, counters=True):
+        trace = TraceBuffer(capacity, counters)
+        interpreter = Interpreter(Parser(Lexer(self.SOURCE)).parse())
+        interpreter.interpret(SymbolTableBuilderVisitor())
+        interpreter.interpret(Visitor(), trace=trace)
+        return trace
+
+    def test_records(self):
+        trace = self.run_traced(16)
+        self.assertEqual(trace.count, 7)
+        # the FOR loop's writes to `i` are records of the FOR node
+        self.assertEqual(trace.records(), [(0, 0, 0.5), (1, 1, 1), (2, 2, 10),
+            (3, 3, 10), (1, 1, 2), (2, 2, 20), (3, 3, 20)])
+
+    def test_counters_are_off_by_default(self):
+        trace = self.run_traced(16, counters=False)
+        self.assertEqual(trace.count, 5)
+        self.assertEqual(trace.records(), [(0, 0, 0.5), (1, 1, 10),
+            (2, 2, 10), (1, 1, 20), (2, 2, 20)])
+
+    def test_trace_is_not_kept_between_runs(self):
+        trace = TraceBuffer(16)
+        interpreter = Interpreter(Parser(Lexer(self.SOURCE)).parse())
+        interpreter.interpret(SymbolTableBuilderVisitor())
+        visitor = Visitor()
+        interpreter.interpret(visitor, trace=trace)
+        interpreter.interpret(visitor)
+        self.assertEqual(trace.count, 5)
+
+    def test_ring_keeps_latest(self):
+        trace = self.run_traced(3)
+        self.assertEqual(trace.count, 7)
+        self.assertEqual(trace.records(), [(1, 1, 2), (2, 2, 20), (3, 3, 20)])
+
+    def test_dump_and_load(self):
+        trace = self.run_traced(4)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            trace.dump(path)
+            loaded = load(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(loaded['count'], 7)
+        self.assertEqual(loaded['slots'], ['X', 'I', 'S', 'A'])
+        self.assertEqual(loaded['nodes'][0], '(X := 0.5)')
+        self.assertEqual(loaded['nodes'][2:], ['(S := (I * 10))', '(A[I] := S)'])
+        self.assertEqual(loaded['records'], trace.records())
+
+    def test_invalid_capacity(self):
+        with self.assertRaises(ValueError):
+            TraceBuffer(0)
+
+    def test_unrepresentable_value(self):
+        trace = TraceBuffer(2)
+        trace.record(object(), 'X', 2 ** 70)
+        self.assertEqual(trace.records(), [(0, 0, None)])
+
+class TestOptimizer(unittest.TestCase):
+
+    PROGRAM = """
+        PROGRAM Opt;
+        VAR a, b, c, d, e : INTEGER;
+        BEGIN
+            b := 3; c := 4;
+            a := 1;
+            a := (b + c) * 2;
+            d := (b + c) * 3 + (b + c) * 2;
+            b := 5;
+            e := b + c;
+            BEGIN d := d + 1 END;
+            a := 10 DIV b;
+            a := 2
+        END.
+    """
+
+    def run_program(self, optimize):
+        interpreter = Interpreter(Parser(Lexer(self.PROGRAM)).parse())
+        interpreter.interpret(SymbolTableBuilderVisitor())
+        report = None
+        if optimize:
+            report = interpreter.interpret(Optimizer())
+        visitor = Visitor()
+        interpreter.interpret(visitor)
+        return visitor.scope, report
+
+    def test_scope_unchanged(self):
+        expected, _ = self.run_program(optimize=False)
+        scope, _ = self.run_program(optimize=True)
+        self.assertEqual(scope, expected)
+
+    def test_report(self):
+        _, report = self.run_program(optimize=True)
+        self.assertEqual(list(map(str, report.subexpressions)),
+            ['(B + C)', '((B + C) * 2)'])
+        # `a := 10 DIV b` may raise, so only `a := 1` is removed
+        self.assertEqual(list(map(str, report.dead_stores)), ['(A := 1)'])
+
+    def test_reassignment_invalidates_subexpression(self):
+        tree = Parser(Lexer("""
+            PROGRAM Opt;
+            VAR a, b, c : INTEGER;
+            BEGIN a := b + c; b := 1; c := b + c END.
+        """)).parse()
+        report = Interpreter(tree).interpret(Optimizer())
+        self.assertEqual(report.subexpressions, [])
+        self.assertEqual(report.dead_stores, [])
+
+    def test_store_reading_unassigned_variable_is_kept(self):
+        tree = Parser(Lexer("""
+            PROGRAM Opt;
+            VAR x, y, z : INTEGER;
+            BEGIN z := 1; x := y + 1; x := z + 1; x := 2 END.
+        """)).parse()
+        interpreter = Interpreter(tree)
+        interpreter.interpret(SymbolTableBuilderVisitor())
+        report = interpreter.interpret(Optimizer())
+        # `y` was never assigned, so `y + 1` raises just as it does
+        # without the optimizer
+        self.assertEqual(list(map(str, report.dead_stores)), ['(X := (Z + 1))'])
+        with self.assertRaises(TypeError):
+            interpreter.interpret(Visitor())
+    def test_store_before_raising_statement_is_kept(self):
+        scopes = []
+        for optimize in (False, True):
+            session = Session(optimize=optimize)
+            session.execute('VAR x, y, z : INTEGER; z := 0')
+            with self.assertRaises(ZeroDivisionError):
+                session.execute('x := 1; y := 1 DIV z; x := 2')
+            scopes.append(session.scope)
+        self.assertEqual(scopes[1], scopes[0])
+        self.assertEqual(scopes[1]['X'], 1)
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        self.session = Session()
+
+    def test_state_persists_between_inputs(self):
+        self.assertEqual(self.session.execute('VAR a, b : INTEGER;'), [])
+        self.assertEqual(self.session.execute('a := 2; b := a * 3'), ['A', 'B'])
+        self.assertEqual(self.session.execute('a := a + b'), ['A'])
+        self.assertEqual(self.session.scope, {'A': 8, 'B': 6})
+
+    def test_declaration_and_statements_in_one_input(self):
+        self.assertEqual(
+            self.session.execute('VAR a, b : INTEGER; a := 1; b := a + 1'),
+            ['A', 'B'])
+        self.assertEqual(self.session.scope, {'A': 1, 'B': 2})
+
+    def test_undeclared_variable(self):
+        with self.assertRaises(NameError):
+            self.session.execute('c := 1')
+
+    def test_failed_array_analysis_declares_nothing(self):
+        with self.assertRaises(IndexError):
+            self.session.execute('VAR c : ARRAY [1..3] OF INTEGER; c[5] := 1')
+        with self.assertRaises(NameError):
+            self.session.execute('c[1] := 1')
+        self.session.execute('VAR c : ARRAY [1..3] OF INTEGER; c[1] := 1')
+        self.assertEqual(list(self.session.scope['C']), [1, 0, 0])
+
+    def test_failed_function_analysis_declares_nothing(self):
+        with self.assertRaises(NameError):
+            self.session.execute('VAR n : INTEGER;'
+                ' FUNCTION F(k : INTEGER) : INTEGER; BEGIN F := q END; n := 1')
+        with self.assertRaises(NameError):
+            self.session.execute('n := F(2)')
+        self.session.execute('VAR n : INTEGER;'
+            ' FUNCTION F(k : INTEGER) : INTEGER; BEGIN F := k END; n := F(2)')
+        self.assertEqual(self.session.scope['N'], 2)
+
+    def test_optimize(self):
+        session = Session(optimize=True)
+        session.execute('VAR a, b, c : INTEGER;')
+        self.assertEqual(session.execute('b := 2; a := b * b + 1; c := b * b'),
+            ['B', 'A', 'C'])
+        self.assertEqual(session.scope, {'A': 5, 'B': 2, 'C': 4})
+        # the optimizer's temporaries stay out of the scope
+        self.assertTrue(session.visitor.temps)
+
+    def test_scope_is_isolated(self):
+        self.session.execute('VAR a : INTEGER; BEGIN a := 1 END')
+        self.assertNotIn('A', Visitor().scope)
+        self.assertNotIn('A', Session().scope)
+
+class TestConcurrentExecution(unittest.TestCase):
+
+    SOURCE = """
+        PROGRAM P{n};
+        VAR i, n, total : INTEGER;
+        BEGIN
+            n := {n}; total := 0;
+            FOR i := 1 TO 200 DO total := total + n * i
+        END.
+    """
+
+    def test_environments_are_isolated(self):
+        first = execute('PROGRAM A; VAR x : INTEGER; BEGIN x := 1 END.')
+        second = execute('PROGRAM B; VAR y : INTEGER; BEGIN y := 2 END.')
+        self.assertEqual(first.scope, {'PROGRAM': 'A', 'X': 1})
+        self.assertEqual(second.scope, {'PROGRAM': 'B', 'Y': 2})
+
+    def test_stress(self):
+        texts = [self.SOURCE.replace('{n}', str(n)) for n in range(300)]
+        environments = execute_concurrently(texts, max_workers=16)
+        for n, environment in enumerate(environments):
+            self.assertEqual(environment.scope, {'PROGRAM': 'P{}'.format(n),
+                'I': 200, 'N': n, 'TOTAL': n * 20100})
+
+    def test_shared_tree(self):
+        text = ('PROGRAM S; VAR i, s : INTEGER;'
+            ' BEGIN FOR i := 1 TO 500 DO s := s + i END.')
+        interpreter = Interpreter(Parser(Lexer(text)).parse())
+        environments = [Environment({'S': start}) for start in range(50)]
+
+        def run(environment):
+            return interpreter.interpret(Visitor(), environment)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(run, environments))
+        for start, environment in enumerate(environments):
+            self.assertEqual(environment.scope['S'], start + 125250)
+
+    def test_errors_are_raised(self):
+        with self.assertRaises(NameError):
+            execute_concurrently(['PROGRAM E; BEGIN x := 1 END.'])
+
+class TestAsyncExecution(unittest.TestCase):
+
+    COUNT = """
+        PROGRAM Count;
+        VAR i, s : INTEGER;
+        BEGIN
+            s := 0;
+            FOR i := 1 TO {n} DO BEGIN s := s + i END
+        END.
+    """
+    FOREVER = 'PROGRAM Forever; BEGIN WHILE 1 < 2 DO END.'
+    IN_FUNCTION = """
+        PROGRAM InFunction;
+        VAR r : INTEGER;
+            a : ARRAY [1..3] OF INTEGER;
+        FUNCTION Slow(n : INTEGER) : INTEGER;
+        VAR i, s : INTEGER;
+        BEGIN
+            s := 0;
+            FOR i := 1 TO n DO s := s + i;
+            Slow := s
+        END;
+        BEGIN
+            a[Slow(1) + 1] := Slow(2);
+            r := Slow({n}) + 1;
+            WHILE r > Slow(3) DO r := r - Slow(Slow(1) + 1)
+        END.
+    """
+
+    def test_same_result_as_sync(self):
+        with open('part10.pas', 'r') as f:
+            text = f.read()
+        environment = asyncio.run(execute_async(text, yield_every=1))
+        self.assertEqual(environment.scope, execute(text).scope)
+
+    def test_event_loop_stays_responsive(self):
+        environment = Environment()
+        seen = []
+
+        async def ticker():
+            for _ in range(5):
+                await asyncio.sleep(0)
+                seen.append(environment.scope.get('I'))
+
+        async def main():
+            text = self.COUNT.replace('{n}', '2000')
+            await asyncio.gather(
+                execute_async(text, environment, yield_every=10), ticker())
+
+        asyncio.run(main())
+        self.assertEqual(environment.scope['S'], 2001000)
+        # the ticker ran while the loop was still in progress
+        self.assertEqual(len(seen), 5)
+        self.assertTrue(all(value < 2000 for value in seen if value))
+        self.assertEqual(seen, sorted(seen, key=lambda value: value or 0))
+
+    def test_function_bodies_are_stepped(self):
+        text = self.IN_FUNCTION.replace('{n}', '300')
+        environment = Environment()
+        seen = []
+
+        async def ticker():
+            for _ in range(5):
+                await asyncio.sleep(0)
+                seen.append(environment.scope.get('R'))
+
+        async def main():
+            await asyncio.gather(
+                execute_async(text, environment, yield_every=10), ticker())
+
+        asyncio.run(main())
+        self.assertEqual(environment.scope, execute(text).scope)
+        # all of the program's work happens inside `Slow`, yet the ticker
+        # ran before `r` was first assigned
+        self.assertEqual(seen, [None] * 5)
+
+    def test_timeout_inside_function(self):
+        text = self.IN_FUNCTION.replace('{n}', '100000000')
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(execute_async(text, yield_every=10, timeout=0.05))
+
+    def test_timeout(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(execute_async(self.FOREVER, timeout=0.05))
+
+    def test_invalid_yield_every(self):
+        for yield_every in (0, -1):
+            with self.assertRaises(ValueError):
+                asyncio.run(execute_async(self.FOREVER, yield_every=yield_every,
+                    timeout=0.1))
+
+    def test_cancellation(self):
+        async def main():
+            task = asyncio.ensure_future(execute_async(self.FOREVER))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await task
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(main())
+
+class TestSharedProgram(unittest.TestCase):
+
+    SOURCE = """
+        PROGRAM Shared;
+        VAR i, s : INTEGER;
+            r : REAL;
+            a : ARRAY [1..10] OF INTEGER;
+        BEGIN
+            s := 0;
+            r := -1.5 * 2;
+            FOR i := 1 TO 10 DO a[i] := i * i;
+            FOR i := 10 DOWNTO 1 DO s := s + a[i] * 2 + a[i] * 2;
+            WHILE s > 100 DO s := s DIV 3
+        END.
+    """
+
+    def _tree(self, text, factory=None):
+        tree = Parser(Lexer(text), factory).parse()
+        tree.accept(SymbolTableBuilderVisitor())
+        return tree
+
+    def _create(self, tree):
+        program = SharedProgram.create(tree)
+        self.addCleanup(program.unlink)
+        self.addCleanup(program.close)
+        return program
+
+    def test_same_scope_as_visitor(self):
+        expected = execute(self.SOURCE).scope
+        tree = self._tree(self.SOURCE, InterningNodeFactory())
+        tree.accept(Optimizer())
+        program = self._create(tree)
+        self.assertEqual(program.run().scope, expected)
+        # runs do not share state
+        self.assertEqual(program.run().scope, expected)
+
+    def test_attach(self):
+        program = self._create(self._tree(self.SOURCE))
+        with SharedProgram.attach(program.name) as attached:
+            self.assertEqual(attached.run().scope, program.run().scope)
+
+    def test_worker_processes(self):
+        scopes = run_in_processes(self._tree(self.SOURCE), 4, max_workers=2)
+        expected = execute(self.SOURCE).scope
+        self.assertEqual(scopes, [expected] * 4)
+
+    def test_index_out_of_range(self):
+        program = self._create(self._tree(
+            'PROGRAM E; VAR i : INTEGER; a : ARRAY [1..3] OF INTEGER;'
+            ' BEGIN i := 4; a[i] := 1 END.'))
+        with self.assertRaises(IndexError):
+            program.run()
+
+    def test_functions(self):
+        text = """
+            PROGRAM F;
+            VAR x, y, g, n : INTEGER;
+                r : REAL;
+            FUNCTION Fib(n : INTEGER) : INTEGER;
+            VAR a, b, t, i : INTEGER;
+            BEGIN
+                a := 0; b := 1;
+                FOR i := 1 TO n DO BEGIN t := a + b; a := b; b := t END;
+                Fib := a
+            END;
+            FUNCTION Bump(k : INTEGER) : INTEGER;
+            VAR v : ARRAY [1..3] OF INTEGER;
+                FUNCTION Twice(j : INTEGER) : INTEGER;
+                BEGIN Twice := j * 2 + k END;
+            BEGIN
+                v[k] := Twice(k);
+                g := g + v[k];
+                Bump := v[k]
+            END;
+            FUNCTION Half(h : REAL) : REAL;
+            BEGIN Half := h / 2 END;
+            BEGIN
+                n := 7; g := 0;
+                x := Fib(20) + Fib(20);
+                y := Bump(2) + Bump(3);
+                r := Half(n)
+            END.
+        """
+        program = self._create(self._tree(text))
+        environment = program.run()
+        self.assertEqual(environment.scope, execute(text).scope)
+        self.assertEqual(environment.scope['X'], 13530)
+        # `Fib` is pure, so its second call is served from the cache of
+        # the run's environment
+        self.assertEqual(environment.function_cache.hits, 1)
+
+    def test_recursion(self):
+        text = """
+            PROGRAM R;
+            VAR x, depth : INTEGER;
+            FUNCTION Down(k : INTEGER) : INTEGER;
+            BEGIN
+                depth := depth + 1;
+                Down := 0;
+                WHILE k > 0 DO BEGIN Down := Down(k - 1) + 1; k := 0 END
+            END;
+            BEGIN depth := 0; x := Down(10) END.
+        """
+        program = self._create(self._tree(text))
+        scope = program.run().scope
+        self.assertEqual(scope, execute(text).scope)
+        self.assertEqual(scope['X'], 10)
+        self.assertEqual(scope['DEPTH'], 11)
+
+    def test_assigned_none_is_kept(self):
+        text = 'PROGRAM N; VAR x, y : INTEGER; BEGIN x := y END.'
+        program = self._create(self._tree(text))
+        self.assertEqual(program.run().scope, {'PROGRAM': 'N', 'X': None})
+        self.assertEqual(program.run().scope, execute(text).scope)
+
+    def test_environment_values_are_visible(self):
+        program = self._create(self._tree(
+            'PROGRAM E; VAR x, y : INTEGER; BEGIN y := x + 1 END.'))
+        scope = program.run(Environment({'X': 41})).scope
+        self.assertEqual(scope, {'PROGRAM': 'E', 'X': 41, 'Y': 42})
+
+
+class TestPreparedProgram(unittest.TestCase):
+
+    SOURCE = """
+        PROGRAM Prepared;
+        VAR n, i, total : INTEGER;
+            rate : REAL;
+            a : ARRAY [1..3] OF INTEGER;
+        BEGIN
+            total := 0;
+            FOR i := 1 TO n DO total := total + i;
+            rate := rate / 2
+        END.
+    """
+
+    def test_run_binds_inputs(self):
+        program = PreparedProgram(self.SOURCE, ['n', 'Rate'])
+        for n in range(5):
+            scope = program.run({'N': n, 'rate': 3})
+            expected = execute(self.SOURCE.replace(
+                'total := 0;', 'total := 0; n := {}; rate := 3.0;'.format(n)))
+            self.assertEqual(scope, expected.scope)
+        self.assertEqual(scope['RATE'], 1.5)
+
+    def test_runs_are_independent(self):
+        program = PreparedProgram(
+            'PROGRAM C; VAR x, y : INTEGER; BEGIN y := y + x END.', ['x', 'y'])
+        self.assertEqual(program.run({'x': 1, 'y': 10})['Y'], 11)
+        self.assertEqual(program.run({'x': 2, 'y': 0})['Y'], 2)
+
+    def test_invalid_parameters(self):
+        with self.assertRaises(NameError):
+            PreparedProgram(self.SOURCE, ['missing'])
+        with self.assertRaises(TypeError):
+            PreparedProgram(self.SOURCE, ['a'])
+
+    def test_invalid_inputs(self):
+        program = PreparedProgram(self.SOURCE, ['n', 'rate'])
+        with self.assertRaises(TypeError):
+            program.run({'n': 1})
+        with self.assertRaises(TypeError):
+            program.run({'n': 1, 'rate': 1, 'total': 5})
+        # names are case-insensitive, so these bind `n` twice
+        with self.assertRaises(TypeError):
+            program.run({'n': 3, 'N': 4, 'rate': 1})
+
 
 if __name__ == '__main__':
     unittest.main()